@@ -0,0 +1,67 @@
+"""Compares size and speed of the JSON and the binary block encoding and
+checks that every block survives the binary round trip unchanged.
+
+Run from the repository root: python -m benchmarks.codec_benchmark
+"""
+import json
+from time import perf_counter
+
+from block import Block
+from transaction import Transaction
+from utility import binary_codec
+from utility.merkle import merkle_root
+
+
+BLOCKS = 200
+TRANSACTIONS_PER_BLOCK = 100
+# Length of a hex encoded 2048 bit RSA public key and of a signature
+KEY_LENGTH = 588
+SIGNATURE_LENGTH = 512
+
+
+def build_chain():
+    chain = [Block(0, '', [], 0, 0)]
+    for index in range(1, BLOCKS + 1):
+        transactions = [
+            Transaction('{:0{}x}'.format(index * TRANSACTIONS_PER_BLOCK + i, KEY_LENGTH),
+                        '{:0{}x}'.format(i, KEY_LENGTH),
+                        '{:0{}x}'.format(index + i, SIGNATURE_LENGTH),
+                        i * 0.5)
+            for i in range(TRANSACTIONS_PER_BLOCK - 1)
+        ]
+        transactions.append(Transaction('MINING', transactions[0].recipient, str(index), 10))
+        chain.append(Block(index, chain[-1].hash, transactions, index * 7919,
+                           merkle_root=merkle_root([tx.id for tx in transactions])))
+    return chain
+
+
+def check_round_trip(chain):
+    """Raises AssertionError if a block changes through the binary encoding."""
+    decoded = binary_codec.decode_blocks(binary_codec.encode_blocks(chain))
+    assert len(decoded) == len(chain)
+    for (block, decoded_block) in zip(chain, decoded):
+        assert decoded_block.canonical_bytes == block.canonical_bytes
+        assert decoded_block.hash == block.hash
+        assert Block.from_dict(json.loads(block.canonical_bytes)).hash == block.hash
+
+
+def measure(name, encode, decode):
+    start = perf_counter()
+    data = encode()
+    encoded = perf_counter()
+    decode(data)
+    decoded = perf_counter()
+    print('{:<7} {:>8.1f} KiB  encode {:>7.1f} ms  decode {:>7.1f} ms'.format(
+        name, len(data) / 1024, (encoded - start) * 1000, (decoded - encoded) * 1000))
+
+
+if __name__ == '__main__':
+    chain = build_chain()
+    check_round_trip(chain)
+    print('{} blocks round trip unchanged'.format(len(chain)))
+    measure('json',
+            lambda: json.dumps([block.to_dict() for block in chain]).encode('utf8'),
+            lambda data: [Block.from_dict(block) for block in json.loads(data)])
+    measure('binary',
+            lambda: binary_codec.encode_blocks(chain),
+            binary_codec.decode_blocks)
@@ -0,0 +1,42 @@
+"""Measures the memory a chain of blocks takes, in total and per block.
+
+Run from the repository root: python -m benchmarks.memory_benchmark
+"""
+import tracemalloc
+
+from block import Block
+from transaction import Transaction
+
+
+TRANSACTIONS = 100000
+TRANSACTIONS_PER_BLOCK = 100
+# Length of a hex encoded 2048 bit RSA public key and of a signature
+KEY_LENGTH = 588
+SIGNATURE_LENGTH = 512
+
+
+def build_chain():
+    chain = [Block(0, '', [], 0, 0)]
+    for index in range(1, TRANSACTIONS // TRANSACTIONS_PER_BLOCK + 1):
+        transactions = [
+            Transaction('{:0{}x}'.format(index * TRANSACTIONS_PER_BLOCK + i, KEY_LENGTH),
+                        '{:0{}x}'.format(i, KEY_LENGTH),
+                        '{:0{}x}'.format(index + i, SIGNATURE_LENGTH),
+                        i)
+            for i in range(TRANSACTIONS_PER_BLOCK)
+        ]
+        chain.append(Block(index, chain[-1].hash, transactions, 0, index))
+    return chain
+
+
+if __name__ == '__main__':
+    tracemalloc.start()
+    chain = build_chain()
+    (current, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    blocks = len(chain) - 1
+    print('{} transactions in {} blocks'.format(TRANSACTIONS, blocks))
+    print('total:           {:>10.1f} MiB'.format(current / 2 ** 20))
+    print('per block:       {:>10.0f} bytes'.format(current / blocks))
+    print('per transaction: {:>10.0f} bytes'.format(current / TRANSACTIONS))
@@ -0,0 +1,57 @@
+"""Compares nonces per second of the proof of work check before and after
+preparing the serialized transactions and previous hash once per block, and
+of the check on a fixed size block header with a Merkle root.
+
+Run from the repository root: python -m benchmarks.proof_benchmark
+"""
+from time import perf_counter
+
+from block import header_prefix
+from transaction import Transaction
+from utility.hash_util import hash_string_256
+from utility.merkle import merkle_root
+from utility.verificatin import PreparedProof
+
+
+TRANSACTIONS = 100
+NONCES = 20000
+
+
+def valid_proof_unprepared(transactions, last_hash, proof):
+    """The proof check as it was done before PreparedProof existed."""
+    ordered_transactions = [
+        tx.to_ordered_dict()
+        for tx in transactions
+    ]
+    guess = (str(ordered_transactions) +
+             str(last_hash) + str(proof)).encode()
+    guess_hash = hash_string_256(guess)
+    return guess_hash[0:2] == '00'
+
+
+def nonces_per_second(check):
+    start = perf_counter()
+    for proof in range(NONCES):
+        check(proof)
+    return NONCES / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    transactions = [
+        Transaction('sender-{}'.format(i) * 20, 'recipient-{}'.format(i) * 20, 'ab' * 128, i)
+        for i in range(TRANSACTIONS)
+    ]
+    last_hash = 'f' * 64
+    prepared_proof = PreparedProof(transactions, last_hash)
+
+    before = nonces_per_second(
+        lambda proof: valid_proof_unprepared(transactions, last_hash, proof))
+    after = nonces_per_second(prepared_proof.is_valid)
+    root = merkle_root([tx.id for tx in transactions])
+    header_proof = PreparedProof(prefix=header_prefix(1, last_hash, root, 0.0, 8), header=True)
+    header = nonces_per_second(header_proof.is_valid)
+
+    print('{} transactions per block'.format(TRANSACTIONS))
+    print('before: {:>12.0f} nonces/s'.format(before))
+    print('after:  {:>12.0f} nonces/s'.format(after))
+    print('header: {:>12.0f} nonces/s'.format(header))
@@ -1,30 +1,156 @@
+import json
+import struct
 from time import time
 
-from transaction import Transaction
+from transaction import Transaction, is_number
+from utility.difficulty import DEFAULT_DIFFICULTY
+from utility.hash_util import hash_string_256
 from utility.printable import Printable
 
 
+# Block header without the proof: index, previous hash, Merkle root, timestamp
+# and difficulty. The proof follows as PROOF, so a header is 90 bytes long.
+HEADER_PREFIX = struct.Struct('>Q32s32sdH')
+PROOF = struct.Struct('>Q')
+
+
+def header_prefix(index, previous_hash, merkle_root, timestamp, difficulty):
+    """Returns the header of a block without its proof, the fixed part of the
+    proof of work input.
+
+    Raises ValueError if a field does not fit into the header.
+    """
+    if len(previous_hash) != 64 or len(merkle_root) != 64:
+        raise ValueError('Block hashes must have 64 hex digits')
+    try:
+        return HEADER_PREFIX.pack(index,
+                                  bytes.fromhex(previous_hash),
+                                  bytes.fromhex(merkle_root),
+                                  timestamp,
+                                  difficulty)
+    except struct.error as error:
+        raise ValueError('Invalid block header: {}'.format(error))
+
+
 class Block(Printable):
+    """An immutable block of transactions. Its canonical serialized form and its
+    hash are computed once when the block is built.
+
+    A block with a Merkle root is hashed by its fixed size header, which the
+    proof of work covers as well. Blocks without one (the genesis block and
+    blocks from before Merkle roots) are hashed by their canonical form, which
+    leaves out the default difficulty so blocks written before difficulties
+    were stored keep their hash.
+    """
+
+    __slots__ = ('index', 'previous_hash', 'timestamp', 'transactions', 'proof', 'difficulty',
+                 'merkle_root', '_canonical_bytes', '_hash')
+
+    def __init__(self, index, previous_hash, transactions, proof, timestamp=None,
+                 difficulty=DEFAULT_DIFFICULTY, merkle_root=None):
+        object.__setattr__(self, 'index', index)
+        object.__setattr__(self, 'previous_hash', previous_hash)
+        object.__setattr__(self, 'timestamp', time() if timestamp is None else timestamp)
+        object.__setattr__(self, 'transactions', tuple(transactions))
+        object.__setattr__(self, 'proof', proof)
+        object.__setattr__(self, 'difficulty', difficulty)
+        object.__setattr__(self, 'merkle_root', merkle_root)
+        canonical_bytes = json.dumps(self.to_dict(), sort_keys=True).encode()
+        object.__setattr__(self, '_canonical_bytes', canonical_bytes)
+        if merkle_root is None:
+            object.__setattr__(self, '_hash', hash_string_256(canonical_bytes))
+        else:
+            object.__setattr__(self, '_hash', hash_string_256(self.header_bytes()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Block is immutable')
 
-    def __init__(self, index, previous_hash, transactions, proof, time=time()):
-        self.index = index
-        self.previous_hash = previous_hash
-        self.timestamp = time
-        self.transactions = transactions
-        self.proof = proof
+    def __reduce__(self):
+        return (Block, (self.index, self.previous_hash, self.transactions, self.proof,
+                        self.timestamp, self.difficulty, self.merkle_root))
+
+    @property
+    def canonical_bytes(self):
+        """The serialized form of the block its hash is computed from."""
+        return self._canonical_bytes
+
+    @property
+    def hash(self):
+        """The hash of the block, computed once when the block was built."""
+        return self._hash
+
+    def header_bytes(self):
+        """Returns the fixed size header of a block with a Merkle root."""
+        try:
+            proof = PROOF.pack(self.proof)
+        except struct.error as error:
+            raise ValueError('Invalid proof: {}'.format(error))
+        return (header_prefix(self.index, self.previous_hash, self.merkle_root,
+                              self.timestamp, self.difficulty) +
+                proof)
+
+    def to_dict(self):
+        """Returns the block as a dictionary with its transactions as dictionaries."""
+        block = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'transactions': [tx.to_dict() for tx in self.transactions],
+            'proof': self.proof
+        }
+        if self.difficulty != DEFAULT_DIFFICULTY:
+            block['difficulty'] = self.difficulty
+        if self.merkle_root is not None:
+            block['merkle_root'] = self.merkle_root
+        return block
+
+    def to_header(self):
+        """Returns the block without its transactions, but with its hash."""
+        return {
+            'index': self.index,
+            'hash': self.hash,
+            'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
+            'timestamp': self.timestamp,
+            'proof': self.proof,
+            'difficulty': self.difficulty
+        }
 
     @staticmethod
-    def from_dictionary(block):
-        """Returns new instance of Block class converted form a dictionary."""
+    def from_dict(block):
+        """Returns new instance of Block class converted from a dictionary.
+
+        Raises ValueError if a field has the wrong type (see decoded).
+        """
+        if not isinstance(block['transactions'], list):
+            raise ValueError('Block transactions must be a list')
         transactions = [
-            Transaction(tx['sender'],
-                        tx['recipient'],
-                        tx['signature'],
-                        tx['amount'])
+            Transaction.from_dict(tx)
             for tx in block['transactions']
         ]
-        return Block(block['index'],
-                     block['previous_hash'],
-                     transactions,
-                     block['proof'],
-                     block['timestamp'],)
+        return Block.decoded(block['index'],
+                             block['previous_hash'],
+                             transactions,
+                             block['proof'],
+                             block['timestamp'],
+                             block.get('difficulty', DEFAULT_DIFFICULTY),
+                             block.get('merkle_root'))
+
+    @staticmethod
+    def decoded(index, previous_hash, transactions, proof, timestamp, difficulty,
+                merkle_root):
+        """Returns a new Block of fields decoded from data of peer nodes.
+
+        Raises ValueError if index, proof or difficulty is no integer, the
+        timestamp no number, or a hash no string.
+        """
+        if not all(isinstance(value, int) and not isinstance(value, bool)
+                   for value in (index, proof, difficulty)):
+            raise ValueError('Block index, proof and difficulty must be integers')
+        if not is_number(timestamp):
+            raise ValueError('Block timestamp must be a number')
+        if not (isinstance(previous_hash, str) and
+                (merkle_root is None or isinstance(merkle_root, str))):
+            raise ValueError('Block hashes must be strings')
+        return Block(index, previous_hash, transactions, proof, timestamp, difficulty,
+                     merkle_root)
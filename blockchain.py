@@ -1,44 +1,154 @@
-from functools import reduce
-
-import json
-import requests
-# import pickle
-
-from block import Block
+import os
+import sqlite3
+from time import time
+
+from block import Block, header_prefix
+from chain_index import ChainIndex
+from chain_store import ChainStore
+from gossip import Gossip
+from key_registry import address_of
+from ledger import Ledger
+from mempool import Mempool
+from miner import Miner
+from peers import PeerClient
+from storage import Storage
 from transaction import Transaction
+from utility import binary_codec
+from utility.chain_view import ChainView, ForkView
+from utility.difficulty import chain_work, median_time_past, next_difficulty
 from utility.hash_util import hash_block
+from utility.merkle import merkle_proof, merkle_root
+from utility.rwlock import RWLock
 from utility.verificatin import Verification
-from wallet import Wallet
+from wallet import Wallet, key_registry
 
 
-# The reward we give to miners (for creating a new block)
+# The reward we give to miners (for creating a new block), the fees of the
+# block's transactions are paid on top
 MINING_REWARD = 10
+# The most open transactions a mined block takes, besides the mining reward
+MAX_BLOCK_TRANSACTIONS = 1000
+# The most bytes the serialized open transactions of a mined block may take
+MAX_BLOCK_BYTES = 1000000
+# How many processes search the proof of work (None uses all cores)
+MINING_WORKERS = None
+# How many blocks are fetched from a peer node with one request while syncing
+SYNC_PAGE_SIZE = 100
+# Every how many blocks the balances are written to a checkpoint
+CHECKPOINT_INTERVAL = 1000
+# Format blocks are sent to and requested from peer nodes in, 'json' or
+# 'binary' (all peer nodes need to understand it)
+WIRE_CODEC = 'json'
 
 
 class Blockchain:
+    """The chain, open transactions and peer nodes of a node.
+
+    Methods changing the state (mine_block, add_block, resolve, add_transaction
+    and the peer node methods) hold the write lock while they change it, so they
+    never interleave. Readers hold the read lock and get views or copies which
+    later changes don't affect. Slow work like the proof of work search,
+    signature checks and network requests happens outside the lock.
+    """
 
     def __init__(self, public_key, node_id):
         genesis_block = Block(0, '', [], 0, 0)
         self.__chain = [genesis_block]
-        self.__open_transactions = []
+        self.__open_transactions = Mempool()
         self.__peer_nodes = set()
+        self.__index = None
+        self.__ledger = Ledger()
+        self.__storage = Storage(node_id)
+        self.__miner = Miner(MINING_WORKERS)
+        self.__peers = PeerClient()
+        self.__gossip = Gossip(self.__peers, self.__on_block_conflict, WIRE_CODEC)
         self.public_key = public_key
         self.node_id = node_id
         self.resolve_conflicts = False
+        self.__listeners = []
+        self.__lock = RWLock()
         self.__load_data()
 
+    def close(self):
+        """Stops gossiping and closes the block log, the journal and the index.
+        The blockchain must not be used afterwards."""
+        self.__gossip.close()
+        with self.__lock.write():
+            self.__storage.close()
+            self.__index.close()
+            self.__chain.close()
+        self.__peers.close()
+
     def get_chain(self):
-        return self.__chain[:]
+        """Returns a read-only snapshot of the chain without copying it."""
+        with self.__lock.read():
+            return ChainView(self.__chain, len(self.__chain))
 
     def get_open_transactions(self):
-        return self.__open_transactions[:]
+        with self.__lock.read():
+            return self.__open_transactions.transactions()
+
+    def get_open_transactions_version(self):
+        """Returns the hash of the last block and the mempool epoch and version,
+        which change whenever the open transactions do."""
+        with self.__lock.read():
+            return (hash_block(self.__chain[-1]),
+                    self.__open_transactions.epoch,
+                    self.__open_transactions.version)
+
+    def get_open_transactions_snapshot(self, start, limit):
+        """Returns the hash of the last block, the mempool epoch and version and
+        a page of the open transactions, read together.
+
+        Arguments:
+            :start: How many open transactions are skipped.
+            :limit: The most open transactions returned.
+        """
+        with self.__lock.read():
+            return (hash_block(self.__chain[-1]),
+                    self.__open_transactions.epoch,
+                    self.__open_transactions.version,
+                    self.__open_transactions.page(start, limit))
+
+    def add_listener(self, listener):
+        """Registers a function which is called with 'tip' when the last block
+        changes and with 'mempool' when an open transaction was added."""
+        self.__listeners.append(listener)
+
+    def get_block_template_ids(self):
+        """Returns the IDs of the open transactions the next mined block would
+        take, in block order."""
+        with self.__lock.read():
+            return tuple(tx.id for tx in self.__open_transactions.block_template(
+                MAX_BLOCK_TRANSACTIONS, MAX_BLOCK_BYTES))
+
+    def get_hash_rate(self):
+        """Returns the hashes per second of the last proof of work search."""
+        return self.__miner.hash_rate
+
+    def get_work(self):
+        """Returns the summed work of all blocks of the chain."""
+        with self.__lock.read():
+            return self.__ledger.work
 
     def get_last_index(self):
         """Returns the index of the last block."""
-        return self.__chain[-1].index
+        with self.__lock.read():
+            return self.__chain[-1].index
+
+    def get_sender(self):
+        """Returns how the node names itself in transactions: by its address once
+        its public key is in a block of the local chain, so peer nodes can
+        resolve it, else by key."""
+        if self.public_key is None:
+            return None
+        address = address_of(self.public_key)
+        if address in key_registry:
+            return address
+        return self.public_key
 
     def get_balance(self, sender=None):
-        """Calculate and return the balance for a participant."""
+        """Return the balance for a participant from the balance index."""
         if sender is None:
             if self.public_key is None:
                 return None
@@ -46,57 +156,32 @@ class Blockchain:
         else:
             participant = sender
 
-        # get all transactions from blockchain
-        # where participant is sender
-        tx_sender = [
-            [
-                tx.amount
-                for tx in block.transactions
-                if tx.sender == participant
-            ]
-            for block in self.__chain
-        ]
-        # get all transactions from open transactions
-        # where participant is sender
-        open_tx_sender = [
-            tx.amount
-            for tx in self.__open_transactions
-            if tx.sender == participant
-        ]
-        tx_sender.append(open_tx_sender)
-        amount_sent = reduce(
-            lambda tx_sum, tx_amt:
-                tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0,
-            tx_sender,
-            0
-        )
+        with self.__lock.read():
+            return self.__balance(participant)
 
-        # get all transactions from blockchain
-        # where participant is recipient
-        tx_recipient = [
-            [
-                tx.amount
-                for tx in block.transactions
-                if tx.recipient == participant
-            ]
-            for block in self.__chain
-        ]
-        amount_received = reduce(
-            lambda tx_sum, tx_amt:
-                tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0,
-            tx_recipient,
-            0
-        )
+    def check_balances(self):
+        """Rebuild the balance index and the pending spends from the chain and the
+        open transactions and return True if they match the maintained ones."""
+        with self.__lock.read():
+            return self.__check_balances()
 
-        return amount_received - amount_sent
+    def __check_balances(self):
+        rebuilt_ledger = Ledger.from_chain(self.__chain)
+        rebuilt_mempool = Mempool(self.__open_transactions.transactions())
+        return (Blockchain.__same_balances(rebuilt_ledger.snapshot(),
+                                           self.__ledger.snapshot()) and
+                Blockchain.__same_balances(rebuilt_mempool.pending_spends(),
+                                           self.__open_transactions.pending_spends()))
 
     def get_last_blockchain_value(self):
         """ Returns the last value of the current blockchain. """
-        if len(self.__chain) < 1:
-            return None
-        return self.__chain[-1]
+        with self.__lock.read():
+            if len(self.__chain) < 1:
+                return None
+            return self.__chain[-1]
 
-    def add_transaction(self, recipient, sender, signature, amount=1.0, is_receiving=False):
+    def add_transaction(self, recipient, sender, signature, amount=1.0, is_receiving=False,
+                        fee=0):
         """ Append a new value as well as the last blockchain value to the blockchain.
 
         Arguments:
@@ -104,66 +189,160 @@ class Blockchain:
             :recipient: The recipient of the coins.
             :signature: The signature of the transaction.
             :amount: The amount of coins sent with the transaction (default = 1.0)
+            :fee: The fee paid to the miner of the block (default = 0)
         """
         if self.public_key is None:
             return False
 
-        transaction = Transaction(sender, recipient, signature, amount)
-        if Verification.verify_transaction(transaction, self.get_balance):
-            self.__open_transactions.append(transaction)
-            self.__save_data()
+        transaction = Transaction(sender, recipient, signature, amount, fee)
+        if not Wallet.verify_transaction(transaction):
+            return False
+
+        with self.__lock.write():
+            if transaction.id in self.__open_transactions:
+                print('Transaction is already known!')
+                return False
+            if not Verification.verify_transaction(transaction, self.__balance):
+                return False
+            self.__open_transactions.add(transaction)
+            self.__journal_open_transactions([transaction])
             if not is_receiving:
-                if self.__broadcast_transaction(transaction) is False:
-                    return False
-            return True
-        return False
+                self.__gossip.enqueue_transaction(self.__peer_nodes, transaction)
+        self.__notify('mempool')
+        return True
+
+    def add_transactions(self, transactions, is_receiving=False):
+        """Adds a batch of transactions to the open transactions.
+
+        The signatures are checked in parallel, the balances one after the other
+        so every transaction is checked against the ones accepted before it.
+        The open transactions are saved and gossiped once for the whole batch.
+
+        Returns a list with one result per transaction, in the given order:
+        'added', 'known', 'invalid signature', 'invalid fee' or 'insufficient
+        funds'; or None if the node has no wallet.
+
+        Arguments:
+            :transactions: The Transaction objects to add.
+            :is_receiving: True if the batch came from a peer node and must not
+                be gossiped again.
+        """
+        if self.public_key is None:
+            return None
 
-    def mine_block(self):
-        """ Create a new block and add open transactions to it. """
+        signatures_valid = Wallet.verify_transactions(transactions)
+        results = []
+        added = []
+        with self.__lock.write():
+            for (tx, signature_valid) in zip(transactions, signatures_valid):
+                if tx.id in self.__open_transactions:
+                    results.append('known')
+                elif not signature_valid:
+                    results.append('invalid signature')
+                elif tx.fee < 0:
+                    results.append('invalid fee')
+                elif self.__balance(tx.sender) < tx.cost:
+                    results.append('insufficient funds')
+                else:
+                    self.__open_transactions.add(tx)
+                    added.append(tx)
+                    results.append('added')
+            if added:
+                self.__journal_open_transactions(added)
+                if not is_receiving:
+                    self.__gossip.enqueue_transactions(self.__peer_nodes, added)
+        if added:
+            self.__notify('mempool')
+        return results
+
+    def mine_block(self, cancel=None):
+        """ Create a new block and add open transactions to it.
+
+        The open transactions with the highest fee per byte are taken, up to
+        MAX_BLOCK_TRANSACTIONS and MAX_BLOCK_BYTES; the others are left for
+        later blocks. The mining reward includes their fees.
+
+        Arguments:
+            :cancel: Optional threading.Event which aborts the proof of work search.
+        """
         if self.public_key is None:
             return None
 
-        last_block = self.__chain[-1]
+        with self.__lock.read():
+            last_block = self.__chain[-1]
+            difficulty = next_difficulty(self.__chain, len(self.__chain))
+            earliest_time = median_time_past(self.__chain, len(self.__chain))
+            copied_transactions = self.__open_transactions.block_template(
+                MAX_BLOCK_TRANSACTIONS, MAX_BLOCK_BYTES)
         hashed_block = hash_block(last_block)
-        proof = self.__get_proof_of_work()
-        reward_transaction = Transaction(
-            'MINING', self.public_key, '', MINING_REWARD)
+        if not all(Wallet.verify_transactions(copied_transactions)):
+            return None
 
-        copied_transactions = self.__open_transactions[:]
-        for tx in copied_transactions:
-            if not Wallet.verify_transaction(tx):
-                return None
+        fees = sum(tx.fee for tx in copied_transactions)
+        # A reward has no signature, the field holds the block index instead so
+        # two rewards of the same amount to the same miner get different IDs
+        reward_transaction = Transaction(
+            'MINING', self.get_sender(), str(last_block.index + 1), MINING_REWARD + fees)
         copied_transactions.append(reward_transaction)
+        root = merkle_root([tx.id for tx in copied_transactions])
+        # Peer nodes reject timestamps which are not later than the median of
+        # the previous blocks, even if the local clock is behind
+        timestamp = max(time(), earliest_time + 0.001)
+        prefix = header_prefix(last_block.index + 1, hashed_block, root, timestamp, difficulty)
+
+        proof = self.__miner.find_proof(prefix, difficulty, cancel)
+        if proof is None:
+            return None
 
-        block = Block(len(self.__chain), hashed_block,
-                      copied_transactions, proof)
-
-        self.__chain.append(block)
-        self.__open_transactions = []
+        block = Block(last_block.index + 1, hashed_block, copied_transactions, proof,
+                      timestamp, difficulty, root)
 
-        self.__save_data()
-        self.__broadcast_block(block)
+        with self.__lock.write():
+            if hash_block(self.__chain[-1]) != hashed_block:
+                print('Chain changed while mining, block dropped!')
+                return None
+            if not self.__append_block(block):
+                return None
+            self.__gossip.enqueue_block(self.__peer_nodes, block)
+        self.__notify('tip')
 
         return block
 
-    def add_block(self, block):
-        incoming_block = Block.from_dictionary(block)
+    def add_block(self, incoming_block):
+        """Appends a block received from a peer node if it extends the local chain.
 
-        proof_is_valid = Verification.valid_proof(incoming_block.transactions[:-1],
-                                                  incoming_block.previous_hash,
-                                                  incoming_block.proof)
-        if not proof_is_valid:
+        Arguments:
+            :incoming_block: The received Block.
+        """
+        # Blocks without a Merkle root are only accepted as part of the stored
+        # chain, new ones have to commit to their transactions
+        if incoming_block.merkle_root is None:
             return False
 
-        hashes_match = hash_block(self.__chain[-1]) == incoming_block.previous_hash
-        if not hashes_match:
+        if not Verification.valid_block_proof(incoming_block):
             return False
 
-        self.__chain.append(incoming_block)
+        if not Verification.valid_reward(incoming_block, MINING_REWARD):
+            return False
 
-        self.__clear_open_transactions(incoming_block)
+        if not all(Wallet.verify_transactions(incoming_block.transactions[:-1])):
+            return False
 
-        self.__save_data()
+        with self.__lock.write():
+            if incoming_block.index != len(self.__chain):
+                return False
+            if not Verification.valid_difficulty(self.__chain, incoming_block):
+                return False
+            if not Verification.valid_block_time(self.__chain, incoming_block):
+                return False
+
+            hashes_match = hash_block(self.__chain[-1]) == incoming_block.previous_hash
+            if not hashes_match:
+                return False
+
+            if not self.__append_block(incoming_block):
+                return False
+        self.__notify('tip')
         return True
 
     def add_peer_node(self, node):
@@ -172,8 +351,9 @@ class Blockchain:
         Arguments:
             :node: The node URL which should be added.
         """
-        self.__peer_nodes.add(node)
-        self.__save_data()
+        with self.__lock.write():
+            self.__peer_nodes.add(node)
+            self.__save_peer_nodes()
 
     def remove_peer_node(self, node):
         """Removes a node from the peer node set.
@@ -181,159 +361,393 @@ class Blockchain:
         Arguments:
             :node: The node URL which should be removeded.
         """
-        self.__peer_nodes.discard(node)
-        self.__save_data()
+        with self.__lock.write():
+            self.__peer_nodes.discard(node)
+            self.__save_peer_nodes()
+        self.__peers.forget(node)
+        self.__gossip.forget(node)
+
+    def get_gossip_stats(self):
+        """Return the depth and lag of the outbound gossip queues."""
+        return self.__gossip.stats()
 
     def get_peer_nodes(self):
         """Return a list of all connected peer nodes."""
-        return list(self.__peer_nodes)
+        with self.__lock.read():
+            return list(self.__peer_nodes)
+
+    def get_tip(self):
+        """Returns the index and the hash of the last block."""
+        with self.__lock.read():
+            last_block = self.__chain[-1]
+        return last_block.index, hash_block(last_block)
+
+    def get_blocks(self, start, limit):
+        """Returns up to `limit` blocks beginning with the block at index `start`."""
+        start = max(start, 0)
+        with self.__lock.read():
+            return self.__chain[start:start + limit]
+
+    def get_merkle_proof(self, tx_id, index):
+        """Returns a (block, position, path) tuple proving that a transaction is
+        part of the Merkle root of the block at `index`, or None if the block
+        has no Merkle root or does not contain the transaction.
 
-    def resolve(self):
-        winner_chain = self.__chain
-        replaced = False
-
-        for node in self.__peer_nodes:
-            url = 'http://{}/chain'.format(node)
-            try:
-                response = requests.get(url)
-                external_chain = [
-                    Block.from_dictionary(block)
-                    for block in response.json()
-                ]
-                external_chain_lenght = len(external_chain)
-                winner_chain_length = len(winner_chain)
-                external_chain_valid = Verification.verify_chain(external_chain)
+        Arguments:
+            :tx_id: The ID of the transaction.
+            :index: The index of the block holding the transaction.
+        """
+        with self.__lock.read():
+            if not 0 <= index < len(self.__chain):
+                return None
+            block = self.__chain[index]
+        if block.merkle_root is None:
+            return None
+        tx_ids = [tx.id for tx in block.transactions]
+        if tx_id not in tx_ids:
+            return None
+        position = tx_ids.index(tx_id)
+        return block, position, merkle_proof(tx_ids, position)
+
+    def find_block(self, block_hash):
+        """Returns the block of the local chain with a hash, or None."""
+        with self.__lock.read():
+            height = self.__index.block_height(block_hash)
+            if height is None:
+                return None
+            return self.__chain[height]
+
+    def find_transaction(self, tx_id):
+        """Returns a (transaction, locations) tuple for a confirmed transaction,
+        where locations lists the (block, position) of every block holding it,
+        or None if no block holds it."""
+        with self.__lock.read():
+            locations = [
+                (self.__chain[height], position)
+                for (height, position) in self.__index.transaction_locations(tx_id)
+            ]
+        if not locations:
+            return None
+        (block, position) = locations[0]
+        return block.transactions[position], locations
 
-                if external_chain_lenght > winner_chain_length and external_chain_valid:
-                    winner_chain = external_chain
-                    replaced = True
+    def get_address_history(self, participant, start, limit):
+        """Returns up to `limit` (block, position) tuples of the confirmed
+        transactions a participant sent or received, oldest first.
 
-            except requests.exceptions.ConnectionError:
-                continue
+        Arguments:
+            :participant: The key or the address of the participant.
+            :start: How many transactions of the history are skipped.
+            :limit: The most transactions returned.
+        """
+        with self.__lock.read():
+            return [
+                (self.__chain[height], position)
+                for (height, position) in self.__index.address_history(participant, start, limit)
+            ]
 
-        self.resolve_conflicts = False
-        self.__chain = winner_chain
+    def get_locator(self):
+        """Returns hashes of blocks from the tip back to the genesis block, dense
+        near the tip and exponentially sparser towards the genesis block."""
+        chain = self.get_chain()
+        return [
+            hash_block(chain[index])
+            for index in Blockchain.__locator_indexes(len(chain))
+        ]
+
+    def find_fork(self, locator):
+        """Returns the index of the first block of a locator which is part of
+        the local chain, or None if no block is known."""
+        with self.__lock.read():
+            for block_hash in locator:
+                index = self.__index.block_height(block_hash)
+                if index is not None:
+                    return index
+        return None
+
+    def resolve(self):
+        """Replaces the local chain by the valid chain of the peer nodes with the
+        most work (see utility.difficulty.block_work).
+
+        All peers are asked at the same time; only the blocks after the last
+        block a peer shares with the local chain are downloaded and verified.
+        """
+        with self.__lock.read():
+            chain = ChainView(self.__chain, len(self.__chain))
+            work = self.__ledger.work
+        peer_nodes = self.get_peer_nodes()
+        statuses = self.__peers.run_all(peer_nodes, self.__get_status)
+        nodes_ahead = {
+            node: status['height']
+            for (node, status) in statuses.items()
+            if status is not None and status['work'] > work
+        }
+        # The locator has to describe the same snapshot the suffixes are
+        # attached to, a block appended meanwhile would be named as the fork
+        locator_indexes = Blockchain.__locator_indexes(len(chain))
+        locator = [hash_block(chain[index]) for index in locator_indexes]
+        suffixes = self.__peers.run_all(
+            nodes_ahead,
+            lambda node: self.__download_suffix(node, nodes_ahead[node], locator,
+                                                set(locator_indexes)))
+
+        winner_chain = chain
+        winner_work = work
+        winner_fork = None
+        for suffix in suffixes.values():
+            if suffix is None:
+                continue
+            (fork_index, external_suffix) = suffix
+            external_chain = ForkView(chain, fork_index, external_suffix)
+            external_work = (work - chain_work(chain[fork_index + 1:]) +
+                             chain_work(external_suffix))
+            if external_work <= winner_work:
+                continue
+            if Verification.verify_chain(external_chain, start=fork_index + 1,
+                                         mining_reward=MINING_REWARD):
+                winner_chain = external_chain
+                winner_work = external_work
+                winner_fork = fork_index
+
+        with self.__lock.write():
+            self.resolve_conflicts = False
+            replaced = (winner_fork is not None and
+                        winner_work > self.__ledger.work and
+                        hash_block(self.__chain[winner_fork]) ==
+                        hash_block(winner_chain[winner_fork]))
+            if replaced:
+                self.__replace_chain(winner_fork, winner_chain.suffix)
         if replaced:
-            self.__open_transactions = []
-        self.__save_data()
+            self.__notify('tip')
 
         return replaced
 
-    def __load_data(self):
-        """Initialize blockchain + open transactions data from a file."""
-        try:
-            with open('tmp_data/blockchain-{}.txt'.format(self.node_id), mode='r') as f:
-                file_content = f.readlines()
-                blockchain = json.loads(file_content[0][:-1])
-                updated_blockchain = []
-                for block in blockchain:
-                    updated_block = Block.from_dictionary(block)
-                    updated_blockchain.append(updated_block)
-                self.__chain = updated_blockchain
-
-                open_transactions = json.loads(file_content[1][:-1])
-                updated_transactions = []
-                for tx in open_transactions:
-                    updated_transaction = Transaction(
-                        tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-                    updated_transactions.append(updated_transaction)
-                self.__open_transactions = updated_transactions
-
-                peer_nodes = json.loads(file_content[2])
-                self.__peer_nodes = set(peer_nodes)
-        except (IOError, IndexError):
-            print('Handled exception...')
-
-    def __save_data(self):
-        """Save blockchain + open transactions snapshot to a file."""
+    def __get_status(self, node):
+        """Returns the /status of a peer node, or None if its height or work is
+        missing or not a number."""
+        status = self.__peers.get(node, '/status').json()
+        if not isinstance(status, dict):
+            return None
+        if not all(isinstance(status.get(key), int) and not isinstance(status.get(key), bool)
+                   for key in ('height', 'work')):
+            return None
+        return status
+
+    def __download_suffix(self, node, height, locator, locator_indexes):
+        """Finds the last block a peer node shares with the local chain and fetches
+        the blocks after it, up to the height it announced. Returns a
+        (fork_index, blocks) tuple, or None if the peer node shares no block or
+        its answers are malformed.
+
+        Arguments:
+            :node: The peer node.
+            :height: The index of the last block the peer node announced.
+            :locator: The locator of the local chain.
+            :locator_indexes: The indexes of the blocks in the locator; the
+                fork index the peer node names has to be one of them.
+        """
         try:
-            with open('tmp_data/blockchain-{}.txt'.format(self.node_id), mode='w') as f:
-                saveable_chain = [
-                    block.__dict__
-                    for block in [
-                        Block(
-                            b.index,
-                            b.previous_hash,
-                            [tx.__dict__ for tx in b.transactions],
-                            b.proof,
-                            b.timestamp
-                        )
-                        for b in self.__chain
-                    ]
-                ]
-                f.write(json.dumps(saveable_chain))
-                f.write('\n')
-                saveable_tx = [
-                    tx.__dict__
-                    for tx in self.__open_transactions
+            return self.__fetch_suffix(node, height, locator, locator_indexes)
+        except (AttributeError, TypeError) as error:
+            print('Peer node {} sent malformed data: {}'.format(node, error))
+            return None
+
+    def __fetch_suffix(self, node, height, locator, locator_indexes):
+        response = self.__peers.post(node, '/locate', json={'locator': locator})
+        fork_index = response.json()['fork_index']
+        if (not isinstance(fork_index, int) or isinstance(fork_index, bool) or
+                fork_index not in locator_indexes):
+            return None
+
+        headers = {}
+        if WIRE_CODEC == 'binary':
+            headers['Accept'] = binary_codec.CONTENT_TYPE
+        blocks = []
+        # A peer node sending more blocks than it announced is not followed
+        # further, the download stays bounded
+        remaining = height - fork_index
+        while remaining > 0:
+            limit = min(SYNC_PAGE_SIZE, remaining)
+            response = self.__peers.get(node, '/blocks',
+                                        params={'from': fork_index + 1 + len(blocks),
+                                                'limit': limit},
+                                        headers=headers)
+            if response.headers.get('Content-Type', '').startswith(binary_codec.CONTENT_TYPE):
+                page = binary_codec.decode_blocks(response.content)
+            else:
+                page = [
+                    Block.from_dict(block)
+                    for block in response.json()
                 ]
-                f.write(json.dumps(saveable_tx))
-                f.write('\n')
-                f.write(json.dumps(list(self.__peer_nodes)))
+            blocks.extend(page[:limit])
+            remaining -= limit
+            if len(page) < limit:
+                break
+        return (fork_index, blocks)
+
+    @staticmethod
+    def __locator_indexes(length):
+        """Returns the indexes of the blocks a locator of a chain with `length`
+        blocks holds, from the tip back to the genesis block."""
+        indexes = []
+        index = length - 1
+        step = 1
+        while index > 0:
+            indexes.append(index)
+            if len(indexes) >= 10:
+                step *= 2
+            index -= step
+        indexes.append(0)
+        return indexes
+
+    def __load_data(self):
+        """Initialize blockchain + open transactions data from the storage."""
+        records, open_transactions, peer_nodes = self.__storage.load()
+        genesis_block = self.__chain[0]
+        self.__chain = ChainStore(self.__storage, records)
+        if len(self.__chain) == 0:
+            self.__chain.append(genesis_block)
+            self.__storage.sync()
+        self.__peer_nodes = peer_nodes
+        self.__index = ChainIndex(os.path.join(self.__storage.path, 'index.sqlite'))
+        self.__index.sync(self.__chain)
+        # A crash may have lost the journal records of transactions a stored
+        # block took out of the mempool
+        mined = set(
+            tx.id
+            for tx in open_transactions
+            if self.__index.transaction_locations(tx.id)
+        )
+        self.__storage.remove_open_transactions(list(mined))
+        self.__open_transactions = Mempool([
+            tx
+            for tx in open_transactions
+            if tx.id not in mined
+        ])
+        self.__ledger = self.__restore_ledger(len(self.__chain))
+
+    def __append_block(self, block):
+        """Appends a verified block and updates everything derived from the chain.
+        Must be called with the write lock held. Returns False if the block
+        could not be written."""
+        try:
+            self.__chain.append(block)
         except IOError:
             print('Saving failed!')
+            return False
+        try:
+            self.__index.add_block(block)
+        except sqlite3.Error:
+            print('Indexing failed!')
+        self.__ledger.apply_block(block)
+        key_registry.register_transactions(block.transactions, block.index)
+        self.__save_checkpoint()
+        removed = self.__open_transactions.remove_transactions(block.transactions)
+        self.__storage.remove_open_transactions([tx.id for tx in removed])
+        if self.__storage.needs_compaction():
+            self.__save_open_transactions()
+        return True
 
-    def __get_proof_of_work(self):
-        """Generate a proof of work for the open transactions, the hash of the previous block and
-        a random number (which is guessed until it fits)."""
-        last_block = self.__chain[-1]
-        last_hash = hash_block(last_block)
-        proof = 0
-
-        while not Verification.valid_proof(self.__open_transactions, last_hash, proof):
-            proof += 1
-
-        return proof
-
-    def __broadcast_transaction(self, transaction):
-        for node in self.__peer_nodes:
-            url = 'http://{}/broadcast-transaction'.format(node)
-
-            try:
-                response = requests.post(url, json={
-                    'sender': transaction.sender,
-                    'recipient': transaction.recipient,
-                    'amount': transaction.amount,
-                    'signature': transaction.signature
-                })
-                if response.status_code == 400 or response.status_code == 500:
-                    print('Transaction declined, need resolving!')
-                    return False
-            except requests.exceptions.ConnectionError:
+    def __replace_chain(self, fork_index, blocks):
+        """Replaces the blocks after `fork_index` by the verified blocks of another
+        chain. Must be called with the write lock held."""
+        try:
+            self.__chain = self.__chain.replace(fork_index + 1, blocks)
+        except IOError:
+            print('Saving failed!')
+            return
+        try:
+            self.__index.truncate(fork_index + 1)
+            for block in blocks:
+                self.__index.add_block(block)
+        except sqlite3.Error:
+            print('Indexing failed!')
+        try:
+            self.__storage.remove_checkpoints(fork_index + 1)
+        except IOError:
+            print('Removing checkpoints failed!')
+        if self.__ledger.rollback(fork_index + 1):
+            key_registry.rollback(fork_index + 1)
+        else:
+            self.__ledger = self.__restore_ledger(fork_index + 1)
+        for block in blocks:
+            self.__ledger.apply_block(block)
+            key_registry.register_transactions(block.transactions, block.index)
+            self.__save_checkpoint()
+        self.__open_transactions = Mempool()
+        Wallet.forget_verified_transactions()
+        self.__save_open_transactions()
+
+    def __restore_ledger(self, length):
+        """Returns the ledger of the first `length` blocks, starting from the
+        latest checkpoint of these blocks instead of the genesis block if
+        there is one. Replaces the keys in key_registry by the keys of these
+        blocks as well."""
+        ledger = Ledger()
+        key_registry.rollback(0)
+        for height in reversed(self.__storage.checkpoints()):
+            if height > length:
                 continue
+            checkpoint = self.__storage.load_checkpoint(height)
+            # Checkpoints of older versions lack the work and are skipped
+            if (checkpoint is not None and 'work' in checkpoint and
+                    checkpoint['hash'] == self.__chain[height - 1].hash):
+                ledger = Ledger(checkpoint['balances'], height, checkpoint['work'])
+                for (key, index) in checkpoint['keys'].items():
+                    key_registry.register(key, index)
+                break
+        for index in range(ledger.height, length):
+            block = self.__chain[index]
+            ledger.apply_block(block)
+            key_registry.register_transactions(block.transactions, block.index)
+        return ledger
+
+    def __save_checkpoint(self):
+        """Writes a checkpoint if the ledger just reached a multiple of
+        CHECKPOINT_INTERVAL blocks."""
+        height = self.__ledger.height
+        if height == 0 or height % CHECKPOINT_INTERVAL != 0:
+            return
+        try:
+            self.__storage.save_checkpoint(height, self.__chain[height - 1].hash,
+                                           self.__ledger.snapshot(), key_registry.keys(height),
+                                           self.__ledger.work)
+        except IOError:
+            print('Saving checkpoint failed!')
 
-        return True
+    def __balance(self, participant):
+        return (self.__ledger.get_balance(participant) -
+                self.__open_transactions.pending_spend(participant))
 
-    def __broadcast_block(self, block):
-        converted_block = block.__dict__.copy()
-        converted_block['transactions'] = [
-            tx.__dict__
-            for tx in converted_block['transactions']
-        ]
-        for node in self.__peer_nodes:
-            url = 'http://{}/broadcast-block'.format(node)
-
-            try:
-                response = requests.post(url, json={'block': converted_block})
-                if response.status_code == 400 or response.status_code == 500:
-                    print('Block declined, need resolving!')
-                if response.status_code == 409:
-                    self.resolve_conflicts = True
-            except requests.exceptions.ConnectionError:
-                continue
+    def __journal_open_transactions(self, transactions):
+        try:
+            self.__storage.add_open_transactions(transactions)
+        except IOError:
+            print('Saving failed!')
 
-        return True
+    def __save_open_transactions(self):
+        try:
+            self.__storage.save_open_transactions(self.__open_transactions.transactions())
+        except IOError:
+            print('Saving failed!')
 
-    def __clear_open_transactions(self, incoming_block):
-        """Removes open transactions that contain in the incoming block."""
-        stored_transactions = self.__open_transactions[:]
-        for itx in incoming_block.transactions:
-            for opentx in stored_transactions:
-                if (opentx.sender == itx.sender and
-                        opentx.recipient == itx.recipient and
-                        opentx.amount == itx.amount and
-                        opentx.signature == itx.signature):
-                    try:
-                        self.__open_transactions.remove(opentx)
-                    except ValueError:
-                        print('Item was already removed')
+    def __save_peer_nodes(self):
+        try:
+            self.__storage.save_peer_nodes(self.__peer_nodes)
+        except IOError:
+            print('Saving failed!')
+
+    def __notify(self, event):
+        for listener in self.__listeners:
+            listener(event)
+
+    def __on_block_conflict(self):
+        """Called by the gossip worker when a peer node rejected a mined block."""
+        self.resolve_conflicts = True
+
+    @staticmethod
+    def __same_balances(expected, actual):
+        return all(
+            abs(expected.get(participant, 0) - actual.get(participant, 0)) <= 1e-9
+            for participant in set(expected) | set(actual)
+        )
@@ -0,0 +1,120 @@
+import sqlite3
+from threading import Lock
+
+from key_registry import address_of
+
+
+class ChainIndex:
+    """Persistent lookup tables of the chain in an SQLite database: block hash to
+    height, transaction ID to block and position, and address to the
+    transactions it takes part in.
+
+    The tables only ever hold the blocks of the local chain. Appended blocks
+    are added, blocks replaced by resolve are removed again.
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+            :path: The file of the database, created if it does not exist.
+        """
+        self.path = path
+        self.__lock = Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        with self.__db:
+            self.__db.execute('CREATE TABLE IF NOT EXISTS blocks ('
+                              'height INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE)')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS transactions ('
+                              'id TEXT NOT NULL, height INTEGER NOT NULL, '
+                              'position INTEGER NOT NULL, PRIMARY KEY (height, position))')
+            self.__db.execute('CREATE INDEX IF NOT EXISTS transactions_by_id '
+                              'ON transactions (id)')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS address_transactions ('
+                              'address TEXT NOT NULL, height INTEGER NOT NULL, '
+                              'position INTEGER NOT NULL, '
+                              'PRIMARY KEY (address, height, position))')
+
+    def sync(self, chain):
+        """Brings the tables in line with a chain, after a crash or a change of
+        the block log while the node was stopped.
+
+        Only blocks after the last block both share are indexed again.
+        """
+        height = min(self.length(), len(chain))
+        while height > 0 and self.block_hash(height - 1) != chain[height - 1].hash:
+            height -= 1
+        self.truncate(height)
+        for index in range(height, len(chain)):
+            self.add_block(chain[index])
+
+    def add_block(self, block):
+        """Adds an appended block and its transactions to the tables."""
+        transactions = [
+            (tx.id, block.index, position)
+            for (position, tx) in enumerate(block.transactions)
+        ]
+        addresses = set()
+        for (position, tx) in enumerate(block.transactions):
+            addresses.add((tx.sender_address, block.index, position))
+            addresses.add((tx.recipient_address, block.index, position))
+        with self.__lock, self.__db:
+            self.__db.execute('INSERT INTO blocks VALUES (?, ?)', (block.index, block.hash))
+            self.__db.executemany('INSERT INTO transactions VALUES (?, ?, ?)', transactions)
+            self.__db.executemany('INSERT INTO address_transactions VALUES (?, ?, ?)',
+                                  addresses)
+
+    def truncate(self, length):
+        """Removes all blocks with an index of `length` or higher."""
+        with self.__lock, self.__db:
+            self.__db.execute('DELETE FROM blocks WHERE height >= ?', (length,))
+            self.__db.execute('DELETE FROM transactions WHERE height >= ?', (length,))
+            self.__db.execute('DELETE FROM address_transactions WHERE height >= ?', (length,))
+
+    def length(self):
+        """Returns the number of indexed blocks."""
+        row = self.__query_one('SELECT MAX(height) FROM blocks')
+        return 0 if row[0] is None else row[0] + 1
+
+    def block_hash(self, height):
+        """Returns the hash of the block at a height, or None."""
+        row = self.__query_one('SELECT hash FROM blocks WHERE height = ?', (height,))
+        return None if row is None else row[0]
+
+    def block_height(self, block_hash):
+        """Returns the height of the block with a hash, or None."""
+        row = self.__query_one('SELECT height FROM blocks WHERE hash = ?', (block_hash,))
+        return None if row is None else row[0]
+
+    def transaction_locations(self, tx_id):
+        """Returns the (height, position) of every block position holding a
+        transaction ID, lowest height first. Only legacy mining rewards, from
+        before rewards held their block index, can share an ID and appear in
+        many blocks."""
+        return self.__query_all('SELECT height, position FROM transactions WHERE id = ? '
+                                'ORDER BY height, position', (tx_id,))
+
+    def address_history(self, participant, start, limit):
+        """Returns up to `limit` (height, position) tuples of the transactions a
+        participant sent or received, oldest first, skipping the first `start`.
+
+        Arguments:
+            :participant: The key or the address of the participant.
+        """
+        return self.__query_all('SELECT height, position FROM address_transactions '
+                                'WHERE address = ? ORDER BY height, position '
+                                'LIMIT ? OFFSET ?',
+                                (address_of(participant), limit, start))
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+    def __query_one(self, sql, parameters=()):
+        with self.__lock:
+            return self.__db.execute(sql, parameters).fetchone()
+
+    def __query_all(self, sql, parameters=()):
+        with self.__lock:
+            return self.__db.execute(sql, parameters).fetchall()
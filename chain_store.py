@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+import mmap
+from threading import Lock
+
+from utility.lru_cache import LRUCache
+
+
+# How many decoded blocks are kept in memory
+BLOCK_CACHE_SIZE = 1000
+# How many segments of the block log are kept mapped at the same time
+MAPPED_SEGMENTS = 16
+
+
+class ChainStore(Sequence):
+    """The chain of a node, read lazily from the memory-mapped block log.
+
+    Only the position of every block in the log and the last block are kept in
+    memory; other blocks are decoded when they are accessed and a bounded
+    number of them is cached. Appending writes the block to the log first.
+
+    A store only ever grows. Replacing blocks returns a new store; the old one
+    keeps the segments which were changed mapped, and as the storage never
+    changes a segment in place, views of the old store keep reading the
+    blocks they cover.
+    """
+
+    def __init__(self, storage, records, tip=None):
+        """
+        Arguments:
+            :storage: The Storage which writes the block log and decodes records.
+            :records: The (segment, start, end) position of every block in the log.
+            :tip: The last block, if it is already decoded.
+        """
+        self.__storage = storage
+        self.__records = records
+        self.__cache = LRUCache(BLOCK_CACHE_SIZE)
+        self.__mapped = OrderedDict()
+        self.__pinned = {}
+        self.__lock = Lock()
+        self.__tip = tip
+        if self.__tip is None and self.__records:
+            self.__tip = self.__decode(len(self.__records) - 1)
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self.__records))[index]]
+        if index < 0:
+            index += len(self.__records)
+        if not 0 <= index < len(self.__records):
+            raise IndexError('block index out of range')
+        if index == len(self.__records) - 1:
+            return self.__tip
+        return self.__cache.get(index, lambda: self.__decode(index))
+
+    def __iter__(self):
+        for index in range(len(self.__records)):
+            yield self[index]
+
+    def append(self, block):
+        """Writes a block to the block log and appends it to the chain."""
+        record = self.__storage.append_block(block)
+        self.__cache.put(len(self.__records), block)
+        self.__records.append(record)
+        self.__tip = block
+
+    def replace(self, start, blocks):
+        """Replaces the blocks from index `start` on, in the log as well, and
+        returns a new store for the resulting chain.
+
+        Arguments:
+            :start: The index of the first block which is replaced.
+            :blocks: The blocks which follow the block at index `start` - 1.
+        """
+        with self.__lock:
+            for segment in sorted(set(record[0] for record in self.__records[start:])):
+                self.__pinned[segment] = self.__map_segment(segment)
+        self.__storage.truncate(start)
+        chain = ChainStore(self.__storage, self.__records[:start], self[start - 1])
+        for block in blocks:
+            chain.append(block)
+        self.__storage.sync()
+        return chain
+
+    def close(self):
+        """Unmaps all segments. Blocks which are accessed later map them again."""
+        with self.__lock:
+            for content in list(self.__mapped.values()) + list(self.__pinned.values()):
+                content.close()
+            self.__mapped.clear()
+            self.__pinned.clear()
+
+    def __decode(self, index):
+        (segment, start, end) = self.__records[index]
+        with self.__lock:
+            if segment in self.__pinned:
+                content = self.__pinned[segment]
+            else:
+                content = self.__mapped.pop(segment, None)
+                if content is None or end > len(content):
+                    if content is not None:
+                        content.close()
+                    content = self.__map_segment(segment)
+                self.__mapped[segment] = content
+                while len(self.__mapped) > MAPPED_SEGMENTS:
+                    self.__mapped.popitem(last=False)[1].close()
+            data = content[start:end]
+        return self.__storage.decode_block(data)
+
+    def __map_segment(self, segment):
+        with open(self.__storage.segment_path(segment), mode='rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,241 @@
+from collections import deque
+from threading import Condition, Thread
+from time import time
+
+import requests
+
+from utility import binary_codec
+from utility.hash_util import hash_string_256
+from utility.lru_cache import LRUCache
+
+
+# How many queued items are taken from the queue of a peer node at once
+BATCH_SIZE = 50
+# How often delivering an item is tried before it is dropped
+MAX_ATTEMPTS = 5
+# Seconds to wait before the first retry, doubled for every further one
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+# How many delivered item keys are remembered per peer node
+SEEN_CACHE_SIZE = 10000
+# The most transactions sent to a peer node in one request, see node.MAX_BATCH_SIZE
+MAX_TRANSACTIONS_PER_REQUEST = 1000
+# Endpoint of the peer nodes every kind of item is posted to
+BROADCAST_PATHS = {
+    'transaction': '/broadcast-transaction',
+    'transactions': '/broadcast-transactions',
+    'block': '/broadcast-block'
+}
+
+
+class GossipItem:
+
+    def __init__(self, kind, key, payload):
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.enqueued_at = time()
+        self.attempts = 0
+        self.next_try = 0
+
+
+class Gossip:
+    """Outbound queue which delivers transactions and blocks to peer nodes
+    from background threads, so callers never wait for the network.
+
+    Every peer node has its own queue and worker thread, so a slow or
+    unreachable peer node only delays its own items. Items a peer node
+    already received are dropped, failed deliveries are retried with
+    exponential backoff.
+    """
+
+    def __init__(self, peers, on_block_conflict=None, codec='json'):
+        """
+        Arguments:
+            :peers: The PeerClient used to contact the peer nodes.
+            :on_block_conflict: Function called when a peer node rejects a
+                block because its chain differs (409).
+            :codec: The format blocks are sent in, 'json' or 'binary'.
+        """
+        self.__peers = peers
+        self.__on_block_conflict = on_block_conflict
+        self.__codec = codec
+        self.__queues = {}
+        self.__seen = {}
+        self.__condition = Condition()
+        self.__workers = {}
+
+    def enqueue_transaction(self, nodes, transaction):
+        """Queues a transaction for all given peer nodes."""
+        self.__enqueue(nodes, GossipItem('transaction', transaction.id, transaction.to_dict()))
+
+    def enqueue_transactions(self, nodes, transactions):
+        """Queues a batch of transactions for all given peer nodes, delivered
+        with a single request."""
+        key = hash_string_256(''.join(tx.id for tx in transactions).encode())
+        payload = {'transactions': [tx.to_dict() for tx in transactions]}
+        self.__enqueue(nodes, GossipItem('transactions', key, payload))
+
+    def enqueue_block(self, nodes, block):
+        """Queues a block for all given peer nodes."""
+        if self.__codec == 'binary':
+            payload = binary_codec.encode_block(block)
+        else:
+            payload = {'block': block.to_dict()}
+        self.__enqueue(nodes, GossipItem('block', block.hash, payload))
+
+    def forget(self, node):
+        """Drops the queue of a peer node which was removed, its worker ends."""
+        with self.__condition:
+            self.__queues.pop(node, None)
+            self.__seen.pop(node, None)
+            self.__condition.notify_all()
+
+    def close(self):
+        """Drops all queues; the workers end after their running delivery."""
+        with self.__condition:
+            self.__queues.clear()
+            self.__seen.clear()
+            self.__condition.notify_all()
+
+    def stats(self):
+        """Returns the queue depth and the lag (age of the oldest queued item in
+        seconds) of every peer node."""
+        now = time()
+        with self.__condition:
+            peers = {
+                node: {
+                    'depth': len(queue),
+                    'lag': now - queue[0].enqueued_at if queue else 0
+                }
+                for (node, queue) in self.__queues.items()
+            }
+        return {
+            'queue_depth': sum(peer['depth'] for peer in peers.values()),
+            'peers': peers
+        }
+
+    def __enqueue(self, nodes, item):
+        with self.__condition:
+            for node in nodes:
+                seen = self.__seen.setdefault(node, LRUCache(SEEN_CACHE_SIZE))
+                if item.key in seen:
+                    continue
+                item_copy = GossipItem(item.kind, item.key, item.payload)
+                self.__queues.setdefault(node, deque()).append(item_copy)
+                if node not in self.__workers:
+                    self.__workers[node] = Thread(target=self.__run, args=(node,),
+                                                  daemon=True)
+                    self.__workers[node].start()
+            self.__condition.notify_all()
+
+    def __run(self, node):
+        """Delivers the queue of one peer node until the peer node is forgotten."""
+        while True:
+            with self.__condition:
+                batch = self.__take_due_batch(node)
+                while not batch:
+                    if node not in self.__queues:
+                        del self.__workers[node]
+                        return
+                    self.__condition.wait(timeout=self.__next_wakeup(node))
+                    batch = self.__take_due_batch(node)
+            try:
+                self.__deliver(node, batch)
+            except (ValueError, KeyError) as error:
+                print('Gossip to {} failed: {}'.format(node, error))
+
+    def __take_due_batch(self, node):
+        """Removes up to BATCH_SIZE due items from the front of the queue of a
+        peer node."""
+        now = time()
+        queue = self.__queues.get(node)
+        batch = []
+        while queue and len(batch) < BATCH_SIZE and queue[0].next_try <= now:
+            batch.append(queue.popleft())
+        return batch
+
+    def __next_wakeup(self, node):
+        queue = self.__queues.get(node)
+        if not queue:
+            return None
+        return max(0, queue[0].next_try - time())
+
+    def __deliver(self, node, batch):
+        """Sends a batch of items to one peer node over its session.
+        Consecutive transactions are sent together in one request."""
+        groups = self.__group(batch)
+        failed = []
+        for (position, group) in enumerate(groups):
+            (path, body) = self.__request(group)
+            try:
+                response = self.__peers.post(node, path, **body)
+            except requests.exceptions.RequestException as error:
+                print('Gossip to {} failed: {}'.format(node, error))
+                failed.extend(item for rest in groups[position:] for item in rest)
+                break
+
+            if response.status_code >= 500 and group[0].kind == 'block':
+                failed.extend(group)
+                continue
+            if response.status_code == 409 and self.__on_block_conflict is not None:
+                self.__on_block_conflict()
+            with self.__condition:
+                if node in self.__seen:
+                    for item in group:
+                        self.__seen[node].put(item.key, True)
+
+        retries = []
+        for item in failed:
+            item.attempts += 1
+            if item.attempts >= MAX_ATTEMPTS:
+                print('Dropping {} {} for {}'.format(item.kind, item.key, node))
+                continue
+            item.next_try = time() + min(RETRY_DELAY * 2 ** (item.attempts - 1),
+                                         MAX_RETRY_DELAY)
+            retries.append(item)
+        with self.__condition:
+            if retries and node in self.__queues:
+                self.__queues[node].extendleft(reversed(retries))
+
+    @staticmethod
+    def __group(batch):
+        """Splits a batch into the lists of items sent with one request: every
+        block on its own, runs of transactions together."""
+        groups = []
+        group_size = 0
+        for item in batch:
+            size = Gossip.__count(item)
+            if (item.kind != 'block' and groups and groups[-1][0].kind != 'block'
+                    and group_size + size <= MAX_TRANSACTIONS_PER_REQUEST):
+                groups[-1].append(item)
+                group_size += size
+            else:
+                groups.append([item])
+                group_size = size
+        return groups
+
+    @staticmethod
+    def __count(item):
+        """Returns how many transactions an item carries."""
+        if item.kind == 'transactions':
+            return len(item.payload['transactions'])
+        return 1
+
+    @staticmethod
+    def __request(group):
+        """Returns the path and the request arguments which send a group."""
+        if len(group) == 1:
+            item = group[0]
+            if isinstance(item.payload, bytes):
+                return (BROADCAST_PATHS[item.kind],
+                        {'data': item.payload,
+                         'headers': {'Content-Type': binary_codec.CONTENT_TYPE}})
+            return (BROADCAST_PATHS[item.kind], {'json': item.payload})
+        transactions = []
+        for item in group:
+            if item.kind == 'transactions':
+                transactions.extend(item.payload['transactions'])
+            else:
+                transactions.append(item.payload)
+        return (BROADCAST_PATHS['transactions'], {'json': {'transactions': transactions}})
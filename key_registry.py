@@ -0,0 +1,104 @@
+from threading import Lock
+
+from utility.hash_util import hash_string_256
+from utility.lru_cache import LRUCache
+
+
+# Length of an address, the first 160 bits of the hex encoded SHA-256 of a key
+ADDRESS_LENGTH = 40
+# How many computed key addresses are kept in memory
+ADDRESS_CACHE_SIZE = 4096
+
+address_cache = LRUCache(ADDRESS_CACHE_SIZE)
+
+
+def address_of(participant):
+    """Returns the short address of a participant.
+
+    Arguments:
+        :participant: A hex encoded public key, or something which is no key
+            (an address, 'MINING') and is returned unchanged.
+    """
+    if len(participant) <= ADDRESS_LENGTH:
+        return participant
+    return address_cache.get(
+        participant,
+        lambda: hash_string_256(participant.encode('ascii'))[:ADDRESS_LENGTH])
+
+
+class KeyRegistry:
+    """Maps addresses to the public keys they were derived from.
+
+    Transactions may name a sender by address once its key appeared in an
+    earlier block of the chain; the registry finds the key to check the
+    signature against. It holds the keys of the local chain only, each with
+    the index of the block it first appeared in, so resolving can be limited
+    to the blocks before a height and a reorg can take keys back.
+    """
+
+    def __init__(self):
+        self.__keys = {}
+        self.__lock = Lock()
+
+    def register(self, key, index):
+        """Remembers a public key; addresses and names are ignored.
+
+        Arguments:
+            :key: The public key.
+            :index: The index of the block the key appeared in.
+        """
+        if len(key) <= ADDRESS_LENGTH:
+            return
+        address = address_of(key)
+        with self.__lock:
+            if address not in self.__keys or self.__keys[address][1] > index:
+                self.__keys[address] = (key, index)
+
+    def register_transactions(self, transactions, index):
+        """Remembers the keys of all senders and recipients of the transactions
+        of the block at `index`."""
+        for tx in transactions:
+            self.register(tx.sender, index)
+            self.register(tx.recipient, index)
+
+    def resolve(self, participant, height=None):
+        """Returns the public key of an address or key, or None if it is unknown.
+
+        Arguments:
+            :participant: The address or key.
+            :height: If given, only keys which appeared in the first `height`
+                blocks are known.
+        """
+        if len(participant) > ADDRESS_LENGTH:
+            return participant
+        with self.__lock:
+            (key, index) = self.__keys.get(participant, (None, None))
+        if key is None or (height is not None and index >= height):
+            return None
+        return key
+
+    def rollback(self, height):
+        """Forgets the keys which first appeared after the first `height` blocks."""
+        with self.__lock:
+            self.__keys = {
+                address: (key, index)
+                for (address, (key, index)) in self.__keys.items()
+                if index < height
+            }
+
+    def keys(self, height):
+        """Returns the keys which appeared in the first `height` blocks as a
+        dictionary, with the index of the block each first appeared in."""
+        with self.__lock:
+            return {
+                key: index
+                for (key, index) in self.__keys.values()
+                if index < height
+            }
+
+    def __contains__(self, address):
+        with self.__lock:
+            return address in self.__keys
+
+    def __len__(self):
+        return len(self.__keys)
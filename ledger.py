@@ -0,0 +1,87 @@
+from collections import deque
+
+from key_registry import address_of
+from utility.difficulty import block_work
+
+
+# How many of the last applied blocks can be rolled back without rebuilding
+UNDO_BLOCKS = 100
+
+
+class Ledger:
+    """Keeps a per-address index of confirmed balances so a balance lookup
+    does not have to rescan the whole chain.
+
+    For the last UNDO_BLOCKS blocks it also keeps undo records (the balances
+    a block changed, as they were before), so a reorg only rolls back to the
+    fork instead of replaying the chain from the start.
+
+    Besides the balances it sums up the work of the blocks (see
+    utility.difficulty.block_work), which decides between competing chains.
+    """
+
+    def __init__(self, balances=None, height=0, work=0):
+        """
+        Arguments:
+            :balances: The confirmed balances by address, e.g. of a checkpoint.
+            :height: The number of blocks the balances include.
+            :work: The summed work of these blocks.
+        """
+        self.__confirmed = dict(balances or {})
+        self.__undo = deque(maxlen=UNDO_BLOCKS)
+        self.height = height
+        self.work = work
+
+    def get_balance(self, participant):
+        """Returns the confirmed balance of a participant, given by key or address."""
+        return self.__confirmed.get(address_of(participant), 0)
+
+    def apply_block(self, block):
+        """Books all transactions of a block as confirmed.
+
+        Arguments:
+            :block: The block which was appended to the chain.
+        """
+        undo = {}
+        for tx in block.transactions:
+            sender = tx.sender_address
+            recipient = tx.recipient_address
+            for address in (sender, recipient):
+                if address not in undo:
+                    undo[address] = self.__confirmed.get(address)
+            self.__confirmed[sender] = self.__confirmed.get(sender, 0) - tx.cost
+            self.__confirmed[recipient] = self.__confirmed.get(recipient, 0) + tx.amount
+        self.__undo.append((undo, block_work(block.difficulty)))
+        self.height += 1
+        self.work += block_work(block.difficulty)
+
+    def rollback(self, height):
+        """Takes back the blocks after the first `height` ones.
+
+        Returns False, without changing anything, if the undo records don't
+        reach back that far.
+        """
+        if self.height - height > len(self.__undo):
+            return False
+        while self.height > height:
+            (undo, work) = self.__undo.pop()
+            for (address, balance) in undo.items():
+                if balance is None:
+                    self.__confirmed.pop(address, None)
+                else:
+                    self.__confirmed[address] = balance
+            self.height -= 1
+            self.work -= work
+        return True
+
+    def snapshot(self):
+        """Returns a copy of the confirmed balances."""
+        return dict(self.__confirmed)
+
+    @staticmethod
+    def from_chain(chain):
+        """Returns new instance of Ledger built from scratch out of a chain."""
+        ledger = Ledger()
+        for block in chain:
+            ledger.apply_block(block)
+        return ledger
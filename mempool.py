@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import heapq
+from itertools import count, islice
+import os
+
+from key_registry import address_of
+
+
+# Random for every run of the node, so mempools of different runs never share
+# an epoch although their versions start from 0 again
+PROCESS_EPOCH = os.urandom(8).hex()
+
+# Numbers the mempools of a run, the rest of the epoch
+mempool_counter = count()
+
+
+class Mempool:
+    """The open transactions of a node, indexed by transaction ID.
+
+    Keeps the order transactions arrived in and the amount every sender
+    address has pending, so duplicates are found and blocks are evicted in time
+    proportional to the block size instead of the mempool size. `version`
+    changes whenever a transaction is added or removed; `epoch` is unique for
+    every mempool, so the two together always name the same transactions.
+
+    A heap orders the transactions by fee per byte for block templates, its
+    entries keep the size of their transaction. Removed transactions stay in
+    the heap until it is rebuilt and are skipped.
+    """
+
+    def __init__(self, transactions=None):
+        self.__transactions = OrderedDict()
+        self.__pending_spend = {}
+        self.__queue = []
+        self.__sequence = {}
+        self.__counter = count()
+        # The size of the smallest transaction in the heap, removed ones included
+        self.__min_size = None
+        self.epoch = '{}.{}'.format(PROCESS_EPOCH, next(mempool_counter))
+        self.version = 0
+        for tx in transactions or []:
+            self.add(tx)
+
+    def add(self, transaction):
+        """Adds a transaction, returns False if it is already in the mempool."""
+        if transaction.id in self.__transactions:
+            return False
+        self.__transactions[transaction.id] = transaction
+        self.version += 1
+        sender = transaction.sender_address
+        self.__pending_spend[sender] = self.__pending_spend.get(sender, 0) + transaction.cost
+        sequence = next(self.__counter)
+        self.__sequence[transaction.id] = sequence
+        size = transaction.size
+        heapq.heappush(self.__queue, (-transaction.fee / size, sequence, size, transaction))
+        if self.__min_size is None or size < self.__min_size:
+            self.__min_size = size
+        return True
+
+    def remove(self, transaction_id):
+        """Removes a transaction by its ID, returns the removed transaction or None."""
+        transaction = self.__transactions.pop(transaction_id, None)
+        if transaction is not None:
+            self.version += 1
+            del self.__sequence[transaction_id]
+            sender = transaction.sender_address
+            remaining = self.__pending_spend[sender] - transaction.cost
+            if remaining:
+                self.__pending_spend[sender] = remaining
+            else:
+                del self.__pending_spend[sender]
+            if len(self.__queue) > 2 * len(self.__transactions) + 64:
+                self.__queue = [
+                    entry
+                    for entry in self.__queue
+                    if self.__sequence.get(entry[3].id) == entry[1]
+                ]
+                heapq.heapify(self.__queue)
+                self.__min_size = min((entry[2] for entry in self.__queue), default=None)
+        return transaction
+
+    def remove_transactions(self, transactions):
+        """Removes all transactions of a (block) list which are in the mempool and
+        returns the removed ones."""
+        removed = [self.remove(tx.id) for tx in transactions]
+        return [tx for tx in removed if tx is not None]
+
+    def block_template(self, max_transactions, max_bytes):
+        """Returns the transactions with the highest fee per byte which fit into
+        a block, best first; ties keep the arrival order.
+
+        The heap is walked until the block is full, in transactions or because
+        the remaining bytes are less than the smallest transaction takes.
+        Larger transactions which don't fit are skipped on the way.
+
+        Arguments:
+            :max_transactions: The most transactions the block may hold.
+            :max_bytes: The most bytes the serialized transactions may take.
+        """
+        selected = []
+        remaining_bytes = max_bytes
+        for (size, tx) in self.__by_priority():
+            if len(selected) >= max_transactions or remaining_bytes < self.__min_size:
+                break
+            if size <= remaining_bytes:
+                selected.append(tx)
+                remaining_bytes -= size
+        return selected
+
+    def pending_spend(self, sender):
+        """Returns the amount and fees a sender, given by key or address, spends
+        in open transactions."""
+        return self.__pending_spend.get(address_of(sender), 0)
+
+    def pending_spends(self):
+        """Returns a copy of the pending amounts of all senders."""
+        return dict(self.__pending_spend)
+
+    def transactions(self):
+        """Returns a list of the open transactions in arrival order."""
+        return list(self.__transactions.values())
+
+    def page(self, start, limit):
+        """Returns up to `limit` open transactions in arrival order, skipping the
+        first `start`, without copying the others."""
+        return list(islice(self.__transactions.values(), start, start + limit))
+
+    def __by_priority(self):
+        """Yields (size, transaction) tuples of the open transactions in heap
+        order without popping the heap: the children of a visited heap entry
+        are the only new candidates, so visiting m entries costs O(m log m)
+        whatever the mempool size. Entries of removed transactions count
+        among the visited ones."""
+        candidates = [(self.__queue[0], 0)] if self.__queue else []
+        while candidates:
+            (entry, position) = heapq.heappop(candidates)
+            if self.__sequence.get(entry[3].id) == entry[1]:
+                yield entry[2], entry[3]
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(self.__queue):
+                    heapq.heappush(candidates, (self.__queue[child], child))
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.__transactions
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __iter__(self):
+        return iter(self.transactions())
@@ -0,0 +1,133 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+import os
+from threading import Lock
+from time import time
+
+from utility.difficulty import DEFAULT_DIFFICULTY
+from utility.verificatin import PreparedProof
+
+
+# How many nonces a worker tries before it looks whether another worker won
+CHECK_INTERVAL = 1000
+# Seconds between two checks whether a running search was cancelled
+CANCEL_POLL_INTERVAL = 0.05
+# How the mining processes are started. Not 'fork': the node is multi-threaded
+# and a forked worker could inherit a lock held by another thread.
+MINING_START_METHOD = 'spawn'
+
+mining_context = multiprocessing.get_context(MINING_START_METHOD)
+mining_pool = None
+mining_pool_workers = 0
+# Set as soon as any worker found a proof or the search was cancelled
+found_event = mining_context.Event()
+# Only one search runs on the pool at a time
+search_lock = Lock()
+pool_lock = Lock()
+
+
+def init_worker(found):
+    """Keeps the shared found event in the worker process."""
+    global found_event
+    found_event = found
+
+
+def get_mining_pool(workers):
+    """Returns the process pool searching proofs, created on first use and kept
+    for all following searches. It is recreated if the number of workers changed."""
+    global mining_pool, mining_pool_workers
+    with pool_lock:
+        if mining_pool is None or mining_pool_workers != workers:
+            if mining_pool is not None:
+                mining_pool.shutdown(wait=False)
+            mining_pool = ProcessPoolExecutor(max_workers=workers,
+                                              mp_context=mining_context,
+                                              initializer=init_worker,
+                                              initargs=(found_event,))
+            mining_pool_workers = workers
+        return mining_pool
+
+
+def search_proof(prefix, difficulty, start, step):
+    """Tries the nonces start, start + step, start + 2 * step, ... until one
+    solves the puzzle or another worker reports a solution. Returns a
+    (proof, tried) tuple, proof is None if the worker stopped without one.
+
+    Arguments:
+        :prefix: The header of the block without its proof.
+        :difficulty: The number of leading zero bits the proof hash needs.
+        :start: The first nonce this worker tries.
+        :step: The distance between two nonces of this worker.
+    """
+    prepared_proof = PreparedProof(difficulty=difficulty, prefix=prefix, header=True)
+    proof = start
+    tried = 0
+    while True:
+        if tried % CHECK_INTERVAL == 0 and found_event.is_set():
+            return (None, tried)
+        tried += 1
+        if prepared_proof.is_valid(proof):
+            found_event.set()
+            return (proof, tried)
+        proof += step
+
+
+class Miner:
+    """Searches a proof of work by splitting the nonce space across the
+    processes of a pool which is shared by all miners and kept between blocks."""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.hash_rate = 0
+
+    def find_proof(self, prefix, difficulty=DEFAULT_DIFFICULTY, cancel=None):
+        """Returns a proof which makes the hash of a block header valid, or None
+        if the search was cancelled.
+
+        Arguments:
+            :prefix: The header of the block without its proof, see block.header_prefix.
+            :difficulty: The number of leading zero bits the block hash needs.
+            :cancel: Optional threading.Event which stops the search when set.
+        """
+        prepared_proof = PreparedProof(difficulty=difficulty, prefix=prefix, header=True)
+        start_time = time()
+
+        if self.workers == 1:
+            proof = 0
+            while not prepared_proof.is_valid(proof):
+                proof += 1
+                if proof % CHECK_INTERVAL == 0 and cancel is not None and cancel.is_set():
+                    self.__update_hash_rate(proof, start_time)
+                    return None
+            self.__update_hash_rate(proof + 1, start_time)
+            return proof
+
+        with search_lock:
+            pool = get_mining_pool(self.workers)
+            found_event.clear()
+            pending = {
+                pool.submit(search_proof, prepared_proof.prefix, difficulty,
+                            start, self.workers)
+                for start in range(self.workers)
+            }
+            proofs = []
+            tried = 0
+            while pending:
+                if cancel is not None and cancel.is_set():
+                    found_event.set()
+                (done, pending) = wait(pending, timeout=CANCEL_POLL_INTERVAL,
+                                       return_when=FIRST_COMPLETED)
+                for future in done:
+                    (proof, worker_tried) = future.result()
+                    tried += worker_tried
+                    if proof is not None:
+                        proofs.append(proof)
+
+        self.__update_hash_rate(tried, start_time)
+        if not proofs or (cancel is not None and cancel.is_set()):
+            return None
+        return min(proofs)
+
+    def __update_hash_rate(self, tried, start_time):
+        elapsed = time() - start_time
+        self.hash_rate = tried / elapsed if elapsed > 0 else tried
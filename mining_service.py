@@ -0,0 +1,98 @@
+from threading import Event, Lock, Thread
+
+
+# Seconds to wait before trying again when no block could be mined
+IDLE_DELAY = 1
+
+
+class MiningService:
+    """Mines blocks on a background thread until it is stopped.
+
+    The running proof of work search is cancelled whenever the last block
+    changes, or a new open transaction changes which transactions the block
+    would take, and started again on the new state, so no work is spent on a
+    block which can't be added anymore. Transactions which don't make it into
+    the block (the block is full of better paying ones) don't restart it.
+    """
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.blocks_mined = 0
+        self.restarts = 0
+        self.__running = False
+        self.__thread = None
+        self.__cancel = Event()
+        self.__template = None
+        self.__wakeup = Event()
+        self.__lock = Lock()
+        blockchain.add_listener(self.__on_change)
+
+    def start(self):
+        """Starts mining, returns False if the service is already running."""
+        with self.__lock:
+            if self.__running:
+                return False
+            if self.__thread is not None:
+                self.__thread.join()
+            self.__running = True
+            self.__wakeup.clear()
+            self.__thread = Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+            return True
+
+    def stop(self, wait=False):
+        """Stops mining and aborts the running search, returns False if the
+        service was not running.
+
+        Arguments:
+            :wait: True waits until the mining thread has ended, e.g. before
+                the blockchain is closed.
+        """
+        with self.__lock:
+            was_running = self.__running
+            self.__running = False
+            self.__cancel.set()
+            self.__wakeup.set()
+            thread = self.__thread
+        if wait and thread is not None:
+            thread.join()
+        return was_running
+
+    def status(self):
+        return {
+            'running': self.__running,
+            'blocks_mined': self.blocks_mined,
+            'restarts': self.restarts,
+            'hash_rate': self.blockchain.get_hash_rate()
+        }
+
+    def __run(self):
+        while self.__running:
+            if self.blockchain.resolve_conflicts:
+                self.__wakeup.wait(IDLE_DELAY)
+                continue
+
+            self.__cancel.clear()
+            # stop() may have run between the loop check and clearing the event
+            if not self.__running:
+                break
+            self.__template = self.blockchain.get_block_template_ids()
+            block = self.blockchain.mine_block(self.__cancel)
+            self.__template = None
+            if block is not None:
+                self.blocks_mined += 1
+            elif self.__cancel.is_set():
+                self.restarts += 1
+            else:
+                self.__wakeup.wait(IDLE_DELAY)
+
+    def __on_change(self, event):
+        """Cancels the running search so it restarts on the changed chain or
+        block template."""
+        if not self.__running:
+            return
+        if event == 'mempool':
+            template = self.__template
+            if template is not None and self.blockchain.get_block_template_ids() == template:
+                return
+        self.__cancel.set()
@@ -1,13 +1,141 @@
 from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
 
+from block import Block
 from blockchain import Blockchain
+from mining_service import MiningService
+from transaction import Transaction, is_number
+from utility import binary_codec
 from wallet import Wallet
 
 
 app = Flask(__name__)
 CORS(app)
 
+# The most blocks or headers a paged endpoint returns with one response
+MAX_PAGE_SIZE = 500
+# The most transactions a batch request may contain
+MAX_BATCH_SIZE = 1000
+
+
+def get_page_args():
+    """Returns the `from` and `limit` query parameters, limited to MAX_PAGE_SIZE."""
+    start = max(request.args.get('from', 0, type=int), 0)
+    limit = request.args.get('limit', MAX_PAGE_SIZE, type=int)
+    return start, max(0, min(limit, MAX_PAGE_SIZE))
+
+
+def wants_binary():
+    """Returns True if the client prefers the binary block format over JSON."""
+    best_match = request.accept_mimetypes.best_match(['application/json',
+                                                      binary_codec.CONTENT_TYPE])
+    return best_match == binary_codec.CONTENT_TYPE
+
+
+def not_modified(etag):
+    """Returns a 304 response if the client already has the ETag, else None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def cached_json_list(etag, load_items, load_binary=None):
+    """Returns a JSON array response built from already serialized items.
+
+    Arguments:
+        :etag: The ETag of the response; if the client already has it, a 304
+            is returned without loading the items. None disables it.
+        :load_items: Function returning the serialized (bytes) array items.
+        :load_binary: Optional function returning the binary encoded items,
+            used instead of load_items if the client accepts the binary format.
+    """
+    binary = load_binary is not None and wants_binary()
+    if etag is not None and binary:
+        etag += '-binary'
+    if etag is not None:
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+    if binary:
+        response = app.response_class(binary_codec.encode_block_list(load_binary()),
+                                      mimetype=binary_codec.CONTENT_TYPE)
+    else:
+        response = app.response_class(b'[' + b','.join(load_items()) + b']',
+                                      mimetype='application/json')
+    if load_binary is not None:
+        response.vary.add('Accept')
+    if etag is not None:
+        response.set_etag(etag)
+    return response, 200
+
+
+def get_batch(required):
+    """Returns the items of a batch request with one entry per item, None for
+    items which are malformed, or an error response.
+
+    Arguments:
+        :required: The fields every item needs.
+    """
+    request_json = request.get_json(silent=True)
+    if not request_json or not isinstance(request_json.get('transactions'), list):
+        response = {'message': "No data found, expected a 'transactions' list!"}
+        return jsonify(response), 400
+    items = request_json['transactions']
+    if len(items) > MAX_BATCH_SIZE:
+        response = {
+            'message': 'At most {} transactions can be sent at once!'.format(MAX_BATCH_SIZE)
+        }
+        return jsonify(response), 400
+
+    def well_formed(item):
+        return (isinstance(item, dict) and
+                all(key in item for key in required) and
+                all(isinstance(item[key], str) for key in required if key != 'amount') and
+                is_number(item['amount']) and
+                is_number(item.get('fee', 0)))
+
+    return [item if well_formed(item) else None for item in items]
+
+
+def batch_response(values, transactions, is_receiving):
+    """Adds the transactions of a batch and returns a response with the result
+    of every item, in the order of the request."""
+    results = blockchain.add_transactions(transactions, is_receiving=is_receiving)
+    if results is None:
+        response = {'message': 'Adding of transactions failed!'}
+        return jsonify(response), 500
+
+    results = iter(zip(transactions, results))
+    items = []
+    for item in values:
+        if item is None:
+            items.append({'status': 'malformed'})
+        else:
+            (transaction, status) = next(results)
+            items.append({'id': transaction.id, 'status': status})
+    added = sum(1 for item in items if item['status'] == 'added')
+    response = {
+        'message': 'Added {} of {} transactions.'.format(added, len(items)),
+        'results': items
+    }
+    if not is_receiving:
+        response['funds'] = blockchain.get_balance()
+    return jsonify(response), 200
+
+
+def replace_blockchain():
+    """Replaces the blockchain and the mining service by ones for the current
+    wallet, once the mining thread ended and the old blockchain is closed, so
+    the old and the new one never write the same files at the same time."""
+    global blockchain, mining_service
+    mining_service.stop(wait=True)
+    blockchain.close()
+    blockchain = Blockchain(wallet.public_key, port)
+    mining_service = MiningService(blockchain)
+
 
 @app.route('/', methods=['GET'])
 def get_node_ui():
@@ -23,10 +151,10 @@ def get_network_ui():
 def create_keys():
     wallet.create_keys()
     if wallet.save_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        replace_blockchain()
         response = {
             'public_key': wallet.public_key,
+            'address': wallet.address,
             'private_key': wallet.private_key,
             'funds': blockchain.get_balance()
         }
@@ -41,10 +169,10 @@ def create_keys():
 @app.route('/wallet', methods=['GET'])
 def load_keys():
     if wallet.load_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        replace_blockchain()
         response = {
             'public_key': wallet.public_key,
+            'address': wallet.address,
             'private_key': wallet.private_key,
             'funds': blockchain.get_balance()
         }
@@ -91,20 +219,31 @@ def add_transaction():
 
     recipient = values['recipient']
     amount = values['amount']
-    signature = wallet.sign_transaction(wallet.public_key,
+    fee = values.get('fee', 0)
+    if not isinstance(recipient, str):
+        response = {'message': 'Recipient must be a string!'}
+        return jsonify(response), 400
+    if not (is_number(amount) and is_number(fee)):
+        response = {'message': 'Amount and fee must be numbers!'}
+        return jsonify(response), 400
+    sender = blockchain.get_sender()
+    signature = wallet.sign_transaction(sender,
                                         recipient,
-                                        amount)
+                                        amount,
+                                        fee)
     success = blockchain.add_transaction(recipient,
-                                         wallet.public_key,
+                                         sender,
                                          signature,
-                                         amount)
+                                         amount,
+                                         fee=fee)
     if success:
         response = {
             'message': 'Successfully added new transaction.',
             'transaction': {
-                'sender': wallet.public_key,
+                'sender': sender,
                 'recipient': recipient,
                 'amount': amount,
+                'fee': fee,
                 'signature': signature
             },
             'funds': blockchain.get_balance()
@@ -125,12 +264,18 @@ def broadcast_transaction():
     if not all(key in request_json for key in required):
         response = {'message': 'Some data is missing!'}
         return jsonify(response), 400
+    try:
+        Transaction.from_dict(request_json)
+    except ValueError:
+        response = {'message': 'Some data has the wrong type!'}
+        return jsonify(response), 400
 
     success = blockchain.add_transaction(request_json['recipient'],
                                          request_json['sender'],
                                          request_json['signature'],
                                          request_json['amount'],
-                                         is_receiving=True)
+                                         is_receiving=True,
+                                         fee=request_json.get('fee', 0))
     if success:
         response = {'message': 'Successfully added new transaction.'}
         return jsonify(response), 201
@@ -139,19 +284,68 @@ def broadcast_transaction():
         return jsonify(response), 500
 
 
+@app.route('/transactions', methods=['POST'])
+def add_transactions():
+    if wallet.public_key is None:
+        response = {'message': 'No wallet set up!'}
+        return jsonify(response), 400
+    values = get_batch(['recipient', 'amount'])
+    if not isinstance(values, list):
+        return values
+
+    sender = blockchain.get_sender()
+    transactions = [
+        Transaction(sender,
+                    item['recipient'],
+                    wallet.sign_transaction(sender, item['recipient'], item['amount'],
+                                            item.get('fee', 0)),
+                    item['amount'],
+                    item.get('fee', 0))
+        for item in values
+        if item is not None
+    ]
+    return batch_response(values, transactions, is_receiving=False)
+
+
+@app.route('/broadcast-transactions', methods=['POST'])
+def broadcast_transactions():
+    values = get_batch(['sender', 'recipient', 'amount', 'signature'])
+    if not isinstance(values, list):
+        return values
+
+    transactions = [
+        Transaction(item['sender'], item['recipient'], item['signature'], item['amount'],
+                    item.get('fee', 0))
+        for item in values
+        if item is not None
+    ]
+    return batch_response(values, transactions, is_receiving=True)
+
+
 @app.route('/broadcast-block', methods=['POST'])
 def broadcast_block():
-    request_json = request.get_json()
-    if not request_json:
-        response = {'message': 'No data found!'}
-        return jsonify(response), 400
-    if 'block' not in request_json:
-        response = {'message': 'Some data is missing!'}
-        return jsonify(response), 400
+    if request.mimetype == binary_codec.CONTENT_TYPE:
+        try:
+            incoming_block = binary_codec.decode_block(request.get_data())
+        except ValueError:
+            response = {'message': 'Block data is malformed!'}
+            return jsonify(response), 400
+    else:
+        request_json = request.get_json()
+        if not request_json:
+            response = {'message': 'No data found!'}
+            return jsonify(response), 400
+        if 'block' not in request_json:
+            response = {'message': 'Some data is missing!'}
+            return jsonify(response), 400
+        try:
+            incoming_block = Block.from_dict(request_json['block'])
+        except (KeyError, TypeError, ValueError):
+            response = {'message': 'Block data is malformed!'}
+            return jsonify(response), 400
 
-    incoming_block = request_json['block']
     # [1],[2],[3] == [1],[2],[3]
-    if incoming_block['index'] == blockchain.get_last_index() + 1:
+    if incoming_block.index == blockchain.get_last_index() + 1:
         if blockchain.add_block(incoming_block):
             response = {'message': 'Successfully added new block.'}
             return jsonify(response), 201
@@ -160,7 +354,7 @@ def broadcast_block():
             print(response['message'])
             return jsonify(response), 409
     # [1],[2],[3],[4],[5] > [1],[2],[3]
-    elif incoming_block['index'] > blockchain.get_last_index():
+    elif incoming_block.index > blockchain.get_last_index():
         response = {
             'message': 'Blockchain seems to be differ from local blockchain, block not added!'
         }
@@ -181,15 +375,12 @@ def mine():
         return jsonify(response), 409
     mined_block = blockchain.mine_block()
     if mined_block is not None:
-        dict_block = mined_block.__dict__.copy()
-        dict_block['transactions'] = [
-            tx.__dict__
-            for tx in dict_block['transactions']
-        ]
+        dict_block = mined_block.to_dict()
         response = {
             'message': 'Block added successfully.',
             'block': dict_block,
-            'funds': blockchain.get_balance()
+            'funds': blockchain.get_balance(),
+            'hash_rate': blockchain.get_hash_rate()
         }
         return jsonify(response), 201
     else:
@@ -200,27 +391,183 @@ def mine():
         return jsonify(response), 500
 
 
+@app.route('/mining/start', methods=['POST'])
+def start_mining():
+    if wallet.public_key is None:
+        response = {'message': 'No wallet set up!'}
+        return jsonify(response), 400
+    if mining_service.start():
+        response = {'message': 'Mining started.'}
+    else:
+        response = {'message': 'Mining is already running.'}
+    response['status'] = mining_service.status()
+    return jsonify(response), 200
+
+
+@app.route('/mining/stop', methods=['POST'])
+def stop_mining():
+    if mining_service.stop():
+        response = {'message': 'Mining stopped.'}
+    else:
+        response = {'message': 'Mining is not running.'}
+    response['status'] = mining_service.status()
+    return jsonify(response), 200
+
+
+@app.route('/mining/status', methods=['GET'])
+def get_mining_status():
+    return jsonify(mining_service.status()), 200
+
+
 @app.route('/chain', methods=['GET'])
 def get_chain():
     chain_snapshot = blockchain.get_chain()
-    dict_chain = [
-        block.__dict__.copy()
-        for block in chain_snapshot
+    (start, limit) = get_page_args()
+    if 'from' not in request.args:
+        # Without a start the page ends at the tip, the blocks clients want most
+        start = max(0, len(chain_snapshot) - limit)
+    etag = '{}-{}-{}'.format(chain_snapshot[-1].hash, start, limit)
+    return cached_json_list(
+        etag,
+        lambda: [block.canonical_bytes for block in chain_snapshot[start:start + limit]],
+        lambda: [binary_codec.encode_block(block)
+                 for block in chain_snapshot[start:start + limit]]
+    )
+
+
+@app.route('/status', methods=['GET'])
+def get_status():
+    height, tip = blockchain.get_tip()
+    response = {
+        'height': height,
+        'tip': tip,
+        'work': blockchain.get_work()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/locate', methods=['POST'])
+def locate():
+    values = request.get_json()
+    if not values or 'locator' not in values:
+        response = {'message': 'No locator found!'}
+        return jsonify(response), 400
+
+    response = {
+        'fork_index': blockchain.find_fork(values['locator'])
+    }
+    return jsonify(response), 200
+
+
+@app.route('/headers', methods=['GET'])
+def get_headers():
+    (start, limit) = get_page_args()
+    headers = [
+        block.to_header()
+        for block in blockchain.get_blocks(start, limit)
     ]
-    for dict_block in dict_chain:
-        dict_block['transactions'] = [
-            tx.__dict__
-            for tx in dict_block['transactions']
+    return jsonify(headers), 200
+
+
+@app.route('/blocks', methods=['GET'])
+def get_blocks():
+    (start, limit) = get_page_args()
+    blocks = blockchain.get_blocks(start, limit)
+    return cached_json_list(
+        None,
+        lambda: [block.canonical_bytes for block in blocks],
+        lambda: [binary_codec.encode_block(block) for block in blocks]
+    )
+
+
+@app.route('/proof/<tx_id>', methods=['GET'])
+def get_merkle_proof(tx_id):
+    index = request.args.get('block', type=int)
+    if index is None:
+        found = blockchain.find_transaction(tx_id)
+        if found is None:
+            response = {'message': 'Transaction not found!'}
+            return jsonify(response), 404
+        index = found[1][0][0].index
+
+    result = blockchain.get_merkle_proof(tx_id, index)
+    if result is None:
+        response = {'message': 'Transaction not found in a block with Merkle root!'}
+        return jsonify(response), 404
+    (block, position, path) = result
+    response = {
+        'tx_id': tx_id,
+        'position': position,
+        'path': path,
+        'header': block.to_header()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/block/<block_hash>', methods=['GET'])
+def get_block(block_hash):
+    block = blockchain.find_block(block_hash)
+    if block is None:
+        response = {'message': 'Block not found!'}
+        return jsonify(response), 404
+    return app.response_class(block.canonical_bytes, mimetype='application/json'), 200
+
+
+@app.route('/tx/<tx_id>', methods=['GET'])
+def get_transaction(tx_id):
+    found = blockchain.find_transaction(tx_id)
+    if found is None:
+        response = {'message': 'Transaction not found!'}
+        return jsonify(response), 404
+    (transaction, locations) = found
+    response = {
+        'transaction': transaction.to_dict(),
+        'blocks': [
+            {
+                'index': block.index,
+                'hash': block.hash,
+                'position': position
+            }
+            for (block, position) in locations
         ]
+    }
+    return jsonify(response), 200
+
 
-    return jsonify(dict_chain), 200
+@app.route('/address/<participant>/history', methods=['GET'])
+def get_address_history(participant):
+    (start, limit) = get_page_args()
+    history = [
+        {
+            'block_index': block.index,
+            'position': position,
+            'transaction': block.transactions[position].to_dict()
+        }
+        for (block, position) in blockchain.get_address_history(participant, start, limit)
+    ]
+    return jsonify(history), 200
 
 
 @app.route('/transactions', methods=['GET'])
 def get_open_transactions():
-    transactions = blockchain.get_open_transactions()
-    dict_transactions = [tx.__dict__ for tx in transactions]
-    return jsonify(dict_transactions), 200
+    (start, limit) = get_page_args()
+    (tip, epoch, version) = blockchain.get_open_transactions_version()
+    response = not_modified('{}-{}-{}-{}-{}'.format(tip, epoch, version, start, limit))
+    if response is not None:
+        return response
+
+    (tip, epoch, version, transactions) = blockchain.get_open_transactions_snapshot(start,
+                                                                                    limit)
+    etag = '{}-{}-{}-{}-{}'.format(tip, epoch, version, start, limit)
+    return cached_json_list(
+        etag,
+        lambda: [tx.canonical_bytes for tx in transactions]
+    )
+
+
+@app.route('/gossip', methods=['GET'])
+def get_gossip_stats():
+    return jsonify(blockchain.get_gossip_stats()), 200
 
 
 @app.route('/nodes', methods=['GET'])
@@ -292,5 +639,6 @@ if __name__ == '__main__':
 
     wallet = Wallet(port)
     blockchain = Blockchain(wallet.public_key, port)
+    mining_service = MiningService(blockchain)
 
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import requests
+
+
+# Seconds to wait for a peer node to connect and to answer
+REQUEST_TIMEOUT = (3.05, 10)
+# How many peer nodes are contacted at the same time
+FANOUT_WORKERS = 16
+
+
+class PeerClient:
+    """Talks to peer nodes over pooled keep-alive sessions with timeouts and
+    contacts many of them concurrently."""
+
+    def __init__(self, scheme='http', timeout=REQUEST_TIMEOUT, workers=FANOUT_WORKERS):
+        self.scheme = scheme
+        self.timeout = timeout
+        self.__sessions = {}
+        self.__lock = Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+
+    def get(self, node, path, **kwargs):
+        """Sends a GET request to a peer node and returns the response.
+
+        Raises requests.exceptions.RequestException if the node can't be reached.
+        """
+        return self.__session(node).get(self.__url(node, path), timeout=self.timeout, **kwargs)
+
+    def post(self, node, path, **kwargs):
+        """Sends a POST request to a peer node and returns the response.
+
+        Raises requests.exceptions.RequestException if the node can't be reached.
+        """
+        return self.__session(node).post(self.__url(node, path), timeout=self.timeout, **kwargs)
+
+    def fan_out(self, nodes, method, path, **kwargs):
+        """Sends the same request to all nodes at the same time.
+
+        Returns a dictionary with the response of every node, or None for the
+        nodes which could not be reached in time.
+
+        Arguments:
+            :nodes: The peer nodes to contact.
+            :method: 'GET' or 'POST'.
+            :path: The path of the endpoint, e.g. '/broadcast-block'.
+        """
+        send = self.get if method == 'GET' else self.post
+        return self.run_all(nodes, lambda node: send(node, path, **kwargs))
+
+    def run_all(self, nodes, task):
+        """Runs task(node) for all nodes at the same time and returns a dictionary
+        with the result of every node, or None for the nodes which failed."""
+        futures = {
+            node: self.__executor.submit(task, node)
+            for node in nodes
+        }
+        results = {}
+        for (node, future) in futures.items():
+            try:
+                results[node] = future.result()
+            except (requests.exceptions.RequestException, ValueError, KeyError) as error:
+                print('Peer node {} failed: {}'.format(node, error))
+                results[node] = None
+        return results
+
+    def close(self):
+        """Closes all sessions and stops the threads contacting peer nodes."""
+        self.__executor.shutdown(wait=False)
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+            self.__sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def forget(self, node):
+        """Closes the session of a peer node which was removed."""
+        with self.__lock:
+            session = self.__sessions.pop(node, None)
+        if session is not None:
+            session.close()
+
+    def __session(self, node):
+        with self.__lock:
+            if node not in self.__sessions:
+                self.__sessions[node] = requests.Session()
+            return self.__sessions[node]
+
+    def __url(self, node, path):
+        return '{}://{}{}'.format(self.scheme, node, path)
@@ -0,0 +1,416 @@
+import json
+import mmap
+import os
+import struct
+
+from block import Block
+from transaction import Transaction
+from utility import binary_codec
+
+
+# How many blocks are kept in one segment file of the block log
+SEGMENT_BLOCKS = 1000
+# How many appended blocks (or open transaction journal writes) may stay
+# unsynced before the file is fsynced
+FSYNC_INTERVAL = 10
+# How many records beyond twice the open transactions the journal may hold
+# before it is rewritten
+JOURNAL_SLACK = 1000
+# Format of the block log records, 'json' (one line per block) or 'binary'
+# (length prefixed records of utility.binary_codec)
+CODEC = 'json'
+
+# How many of the latest balance checkpoints are kept
+CHECKPOINTS_KEPT = 3
+
+RECORD_SIZE = struct.Struct('>I')
+
+
+class Storage:
+    """Stores the blockchain of a node in an append-only, segmented block log,
+    a journal of the open transactions and a small file for the peer nodes.
+
+    Layout of the node directory (tmp_data/blockchain-<node_id>/):
+        blocks-<segment>.log     one JSON record per line, one block per record
+        blocks-<segment>.bin     the same with binary records, if codec is 'binary'
+        open_transactions.log    one JSON record per line, an added
+                                 transaction or the ID of a removed one
+        peer_nodes.json          rewritten atomically on each change
+        checkpoint-<height>.json balances, keys and work of the first <height> blocks
+
+    Blocks are not read by load; it only indexes the records, ChainStore
+    decodes them when they are accessed.
+
+    Open transactions a block removed are only written to the journal after
+    the block log was fsynced, so a crash never loses a block together with
+    the transactions it took out of the mempool.
+    """
+
+    def __init__(self, node_id, directory='tmp_data', codec=CODEC):
+        """
+        Arguments:
+            :node_id: The port of the node, used to name its directory.
+            :directory: The directory holding the data of all nodes.
+            :codec: The format of the block log records, 'json' or 'binary'.
+        """
+        if codec not in ('json', 'binary'):
+            raise ValueError('Unknown block log codec {}'.format(codec))
+        self.node_id = node_id
+        self.codec = codec
+        self.extension = '.log' if codec == 'json' else '.bin'
+        self.path = os.path.join(directory, 'blockchain-{}'.format(node_id))
+        self.legacy_path = os.path.join(directory, 'blockchain-{}.txt'.format(node_id))
+        self.__length = 0
+        self.__log = None
+        self.__unsynced = 0
+        self.__journal = None
+        self.__journal_unsynced = 0
+        self.__journal_records = 0
+        self.__open_count = 0
+        self.__removed = []
+
+    def load(self):
+        """Reads the block index, open transactions and peer nodes back from disk.
+
+        Returns a (records, open_transactions, peer_nodes) tuple. records holds
+        a (segment, start, end) tuple per block with the position of the
+        encoded block, see read_block. A node without stored data gets no records.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self.legacy_path) and not os.path.exists(self.segment_path(0)):
+            self.__migrate_legacy()
+
+        records = self.__index_blocks()
+        self.__length = len(records)
+        open_transactions = self.__read_journal()
+        peer_nodes = set(self.__read_json('peer_nodes.json', []))
+        return records, open_transactions, peer_nodes
+
+    def decode_block(self, data):
+        """Returns the Block of the encoded block of a record."""
+        if self.codec == 'json':
+            return Block.from_dict(json.loads(bytes(data).decode('utf8')))
+        return binary_codec.decode_block(data)
+
+    def append_block(self, block):
+        """Appends one block as a single record to the block log and returns the
+        (segment, start, end) position of the encoded block."""
+        segment = self.__length // SEGMENT_BLOCKS
+        if self.__log is None or self.__length % SEGMENT_BLOCKS == 0:
+            self.__open_segment(segment)
+        record = self.__encode_record(block)
+        start = self.__log.tell()
+        self.__log.write(record)
+        self.__log.flush()
+        if self.codec == 'json':
+            position = (segment, start, start + len(record) - 1)
+        else:
+            position = (segment, start + RECORD_SIZE.size, start + len(record))
+        self.__length += 1
+        self.__unsynced += 1
+        if self.__unsynced >= FSYNC_INTERVAL:
+            self.sync()
+        return position
+
+    def truncate(self, length):
+        """Drops all blocks with an index of `length` or higher from the log.
+
+        Segments are removed or replaced by shortened copies, never changed in
+        place, so readers which still have a segment open keep their blocks.
+        """
+        self.sync()
+        self.__close_segment()
+        for segment in self.__segments():
+            first_index = segment * SEGMENT_BLOCKS
+            segment_path = self.segment_path(segment)
+            if first_index >= length:
+                os.remove(segment_path)
+            elif first_index + SEGMENT_BLOCKS > length:
+                (bounds, valid_size) = self.__scan_segment(segment_path)
+                kept = length - first_index
+                size = bounds[kept][0] if kept < len(bounds) else valid_size
+                if self.codec == 'binary' and kept < len(bounds):
+                    size -= RECORD_SIZE.size
+                with open(segment_path, mode='rb') as f:
+                    content = f.read(size)
+                self.__write_atomic(segment_path, content)
+        self.__length = min(self.__length, length)
+
+    def add_open_transactions(self, transactions):
+        """Appends added open transactions to the journal."""
+        self.__write_journal([{'tx': tx.to_dict()} for tx in transactions])
+        self.__open_count += len(transactions)
+
+    def remove_open_transactions(self, transaction_ids):
+        """Records open transactions which an appended block removed. They are
+        written to the journal with the next sync, after the block log."""
+        self.__removed.extend(transaction_ids)
+        self.__open_count -= len(transaction_ids)
+
+    def needs_compaction(self):
+        """Returns True if the journal holds so many removed transactions that
+        it should be rewritten with save_open_transactions."""
+        return self.__journal_records > 2 * self.__open_count + JOURNAL_SLACK
+
+    def save_open_transactions(self, open_transactions):
+        """Replaces the journal by one holding just the given open transactions."""
+        self.sync()
+        self.__close_journal()
+        self.__write_atomic(
+            self.__journal_path(),
+            ''.join(json.dumps({'tx': tx.to_dict()}) + '\n' for tx in open_transactions)
+        )
+        self.__journal_records = self.__open_count = len(open_transactions)
+
+    def save_peer_nodes(self, peer_nodes):
+        self.__write_atomic(
+            os.path.join(self.path, 'peer_nodes.json'),
+            json.dumps(list(peer_nodes))
+        )
+
+    def save_checkpoint(self, height, block_hash, balances, keys, work):
+        """Writes the state after the first `height` blocks and removes all but
+        the CHECKPOINTS_KEPT latest checkpoints.
+
+        Arguments:
+            :height: The number of blocks the state includes.
+            :block_hash: The hash of the last of these blocks.
+            :balances: The confirmed balances by address.
+            :keys: The public keys seen in these blocks, with the index of the
+                block each first appeared in.
+            :work: The summed work of these blocks.
+        """
+        self.__write_atomic(self.__checkpoint_path(height), json.dumps({
+            'height': height,
+            'hash': block_hash,
+            'balances': balances,
+            'keys': keys,
+            'work': work
+        }))
+        for old_height in self.checkpoints()[:-CHECKPOINTS_KEPT]:
+            os.remove(self.__checkpoint_path(old_height))
+
+    def load_checkpoint(self, height):
+        """Returns the checkpoint after the first `height` blocks as a dictionary
+        with 'height', 'hash', 'balances', 'keys' and 'work', or None if it can't
+        be read."""
+        return self.__read_json(os.path.basename(self.__checkpoint_path(height)), None)
+
+    def checkpoints(self):
+        """Returns the heights of all stored checkpoints in ascending order."""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            int(name[len('checkpoint-'):-len('.json')])
+            for name in os.listdir(self.path)
+            if name.startswith('checkpoint-') and name.endswith('.json')
+        )
+
+    def remove_checkpoints(self, height):
+        """Removes the checkpoints after more than the first `height` blocks."""
+        for checkpoint_height in self.checkpoints():
+            if checkpoint_height > height:
+                os.remove(self.__checkpoint_path(checkpoint_height))
+
+    def sync(self):
+        """Forces all appended blocks to disk, then the journal of the open
+        transactions including the ones the blocks removed."""
+        if self.__log is not None and self.__unsynced > 0:
+            self.__log.flush()
+            os.fsync(self.__log.fileno())
+        self.__unsynced = 0
+        if self.__removed:
+            removed = self.__removed
+            self.__removed = []
+            self.__write_journal([{'removed': tx_id} for tx_id in removed])
+        if self.__journal is not None and self.__journal_unsynced > 0:
+            os.fsync(self.__journal.fileno())
+        self.__journal_unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.__close_segment()
+        self.__close_journal()
+
+    def __migrate_legacy(self):
+        """Converts the old three line blockchain-<node_id>.txt file once."""
+        try:
+            with open(self.legacy_path, mode='r') as f:
+                file_content = f.readlines()
+            blocks = json.loads(file_content[0])
+            open_transactions = json.loads(file_content[1])
+            peer_nodes = json.loads(file_content[2])
+        except (IOError, IndexError, ValueError):
+            print('Migrating legacy data failed!')
+            return
+
+        # Split into segments of SEGMENT_BLOCKS blocks like append_block writes
+        # them; the first segment is written last, so load migrates again if
+        # it was interrupted
+        first_indexes = range(0, max(len(blocks), 1), SEGMENT_BLOCKS)
+        for first_index in reversed(first_indexes):
+            self.__write_atomic(self.segment_path(first_index // SEGMENT_BLOCKS), b''.join(
+                self.__encode_record(Block.from_dict(block))
+                for block in blocks[first_index:first_index + SEGMENT_BLOCKS]
+            ))
+        self.__write_atomic(self.__journal_path(),
+                            ''.join(json.dumps({'tx': tx}) + '\n' for tx in open_transactions))
+        self.__write_atomic(os.path.join(self.path, 'peer_nodes.json'),
+                            json.dumps(peer_nodes))
+        os.replace(self.legacy_path, self.legacy_path + '.migrated')
+
+    def __index_blocks(self):
+        """Finds the records of all blocks of the log without decoding them. A
+        torn record at the end of the last segment (from a crash mid-write) is
+        cut off."""
+        records = []
+        for segment in self.__segments():
+            segment_path = self.segment_path(segment)
+            (bounds, valid_size) = self.__scan_segment(segment_path)
+            records.extend((segment, start, end) for (start, end) in bounds)
+            torn = os.path.getsize(segment_path) != valid_size
+            if torn:
+                print('Dropping torn record from {}'.format(segment_path))
+                with open(segment_path, mode='r+b') as f:
+                    f.truncate(valid_size)
+                break
+        return records
+
+    def __scan_segment(self, segment_path):
+        """Returns the (start, end) offsets of the encoded block of every complete
+        record of a segment and the offset where the complete records end."""
+        bounds = []
+        offset = 0
+        with open(segment_path, mode='rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return bounds, offset
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                while offset < len(content):
+                    if self.codec == 'json':
+                        end = content.find(b'\n', offset)
+                        if end < 0:
+                            break
+                        bounds.append((offset, end))
+                        offset = end + 1
+                    else:
+                        if offset + RECORD_SIZE.size > len(content):
+                            break
+                        (size,) = RECORD_SIZE.unpack_from(content, offset)
+                        end = offset + RECORD_SIZE.size + size
+                        if end > len(content):
+                            break
+                        bounds.append((offset + RECORD_SIZE.size, end))
+                        offset = end
+        return bounds, offset
+
+    def __encode_record(self, block):
+        if self.codec == 'json':
+            return (json.dumps(block.to_dict()) + '\n').encode('utf8')
+        data = binary_codec.encode_block(block)
+        return RECORD_SIZE.pack(len(data)) + data
+
+    def __read_journal(self):
+        """Replays the journal of the open transactions, or reads the
+        open_transactions.json of older versions. A torn last record is ignored."""
+        journal_path = self.__journal_path()
+        if not os.path.exists(journal_path):
+            transactions = [
+                Transaction.from_dict(tx)
+                for tx in self.__read_json('open_transactions.json', [])
+            ]
+            if transactions:
+                self.save_open_transactions(transactions)
+                os.remove(os.path.join(self.path, 'open_transactions.json'))
+            return transactions
+
+        open_transactions = {}
+        records = 0
+        torn = False
+        try:
+            with open(journal_path, mode='r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if 'tx' in record:
+                            tx = Transaction.from_dict(record['tx'])
+                            open_transactions[tx.id] = tx
+                        else:
+                            open_transactions.pop(record['removed'], None)
+                    except (KeyError, TypeError, ValueError):
+                        torn = True
+                        continue
+                    torn = torn or not line.endswith('\n')
+                    records += 1
+        except IOError:
+            print('Loading open transactions failed!')
+        transactions = list(open_transactions.values())
+        self.__journal_records = records
+        self.__open_count = len(transactions)
+        if torn:
+            # Rewritten so appended records don't continue a torn line
+            self.save_open_transactions(transactions)
+        return transactions
+
+    def __write_journal(self, records):
+        if not records:
+            return
+        if self.__journal is None:
+            self.__journal = open(self.__journal_path(), mode='a')
+        self.__journal.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.__journal.flush()
+        self.__journal_records += len(records)
+        self.__journal_unsynced += 1
+        if self.__journal_unsynced >= FSYNC_INTERVAL:
+            os.fsync(self.__journal.fileno())
+            self.__journal_unsynced = 0
+
+    def __close_journal(self):
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
+
+    def __journal_path(self):
+        return os.path.join(self.path, 'open_transactions.log')
+
+    def __read_json(self, name, default):
+        try:
+            with open(os.path.join(self.path, name), mode='r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return default
+
+    def __segments(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            int(name[len('blocks-'):-len(self.extension)])
+            for name in os.listdir(self.path)
+            if name.startswith('blocks-') and name.endswith(self.extension)
+        )
+
+    def __checkpoint_path(self, height):
+        return os.path.join(self.path, 'checkpoint-{:09d}.json'.format(height))
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, 'blocks-{:06d}{}'.format(segment, self.extension))
+
+    def __open_segment(self, segment):
+        self.sync()
+        self.__close_segment()
+        self.__log = open(self.segment_path(segment), mode='ab')
+
+    def __close_segment(self):
+        if self.__log is not None:
+            self.__log.close()
+            self.__log = None
+
+    @staticmethod
+    def __write_atomic(path, content):
+        """Writes a file through a temporary file so readers see either the old
+        or the new content, never a partially written one."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, mode='wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
@@ -0,0 +1,112 @@
+"""Checks that blocks and transactions survive the binary encoding unchanged,
+so their canonical bytes and hashes match the ones of the JSON format.
+
+Run from the repository root: python -m unittest discover tests
+"""
+import json
+import unittest
+
+from block import Block
+from transaction import Transaction
+from utility import binary_codec
+from utility.difficulty import DEFAULT_DIFFICULTY
+from utility.merkle import merkle_root
+
+
+# Length of a hex encoded 2048 bit RSA public key and of a signature
+KEY_LENGTH = 588
+SIGNATURE_LENGTH = 512
+
+
+def hex_string(value, length):
+    return '{:0{}x}'.format(value, length)
+
+
+def build_block(index, previous_hash, transactions, difficulty=DEFAULT_DIFFICULTY):
+    return Block(index, previous_hash, transactions, index * 7919, 1500000000.25 + index,
+                 difficulty, merkle_root([tx.id for tx in transactions]))
+
+
+class BinaryCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transactions = [
+            Transaction(hex_string(1, KEY_LENGTH), hex_string(2, KEY_LENGTH),
+                        hex_string(3, SIGNATURE_LENGTH), 2.5),
+            Transaction(hex_string(4, KEY_LENGTH), hex_string(5, KEY_LENGTH),
+                        hex_string(6, SIGNATURE_LENGTH), 7, fee=0.25),
+            Transaction(hex_string(7, KEY_LENGTH), 'Not Hex', 'ABCDEF', 2 ** 70),
+            Transaction('MINING', hex_string(2, KEY_LENGTH), '', 10.25)
+        ]
+
+    def assert_same_block(self, decoded, block):
+        self.assertEqual(decoded.canonical_bytes, block.canonical_bytes)
+        self.assertEqual(decoded.hash, block.hash)
+        self.assertEqual(decoded.canonical_bytes,
+                         Block.from_dict(json.loads(block.canonical_bytes)).canonical_bytes)
+
+    def test_transaction_round_trip(self):
+        for tx in self.transactions:
+            decoded = binary_codec.decode_transaction(binary_codec.encode_transaction(tx))
+            self.assertEqual(decoded.canonical_bytes, tx.canonical_bytes)
+            self.assertEqual(decoded.id, tx.id)
+            self.assertEqual(decoded.to_dict(), tx.to_dict())
+
+    def test_block_round_trip(self):
+        block = build_block(1, hex_string(9, 64), self.transactions)
+        decoded = binary_codec.decode_block(binary_codec.encode_block(block))
+        self.assert_same_block(decoded, block)
+        self.assertEqual(decoded.merkle_root, block.merkle_root)
+        self.assertEqual(decoded.to_dict(), block.to_dict())
+
+    def test_retargeted_block_round_trip(self):
+        block = build_block(3, hex_string(9, 64), self.transactions, difficulty=13)
+        self.assert_same_block(binary_codec.decode_block(binary_codec.encode_block(block)),
+                               block)
+
+    def test_legacy_block_round_trip(self):
+        """Blocks without a merkle root are hashed from their JSON form."""
+        block = Block(2, hex_string(9, 64), self.transactions, 42, 1500000000.5)
+        decoded = binary_codec.decode_block(binary_codec.encode_block(block))
+        self.assertIsNone(decoded.merkle_root)
+        self.assert_same_block(decoded, block)
+
+    def test_genesis_block_round_trip(self):
+        block = Block(0, '', [], 0, 0)
+        self.assert_same_block(binary_codec.decode_block(binary_codec.encode_block(block)),
+                               block)
+
+    def test_block_list_round_trip(self):
+        chain = [Block(0, '', [], 0, 0)]
+        for index in range(1, 5):
+            chain.append(build_block(index, chain[-1].hash, self.transactions[:index]))
+        decoded = binary_codec.decode_blocks(binary_codec.encode_blocks(chain))
+        self.assertEqual(len(decoded), len(chain))
+        for (decoded_block, block) in zip(decoded, chain):
+            self.assert_same_block(decoded_block, block)
+        encoded = [binary_codec.encode_block(block) for block in chain]
+        self.assertEqual(binary_codec.encode_block_list(encoded),
+                         binary_codec.encode_blocks(chain))
+
+    def test_malformed_data(self):
+        data = binary_codec.encode_block(build_block(1, hex_string(9, 64), self.transactions))
+        with self.assertRaises(ValueError):
+            binary_codec.decode_block(data[:len(data) // 2])
+        with self.assertRaises(ValueError):
+            binary_codec.decode_blocks(b'\x00\x00\x00\x02')
+
+    def test_wrongly_typed_fields(self):
+        transaction = Transaction('MINING', hex_string(2, KEY_LENGTH), '1', '10')
+        with self.assertRaises(ValueError):
+            binary_codec.decode_transaction(binary_codec.encode_transaction(transaction))
+        block = Block(1, hex_string(9, 64), [], '7', 1500000000.25)
+        with self.assertRaises(ValueError):
+            binary_codec.decode_block(binary_codec.encode_block(block))
+        with self.assertRaises(ValueError):
+            Block.from_dict(dict(block.to_dict(), proof=7, transactions=[
+                dict(transaction.to_dict(), amount=10, fee='1')
+            ]))
+
+
+if __name__ == '__main__':
+    unittest.main()
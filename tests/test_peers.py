@@ -0,0 +1,131 @@
+"""Checks PeerClient against stand-in peer nodes: small Flask apps served from
+background threads on free local ports.
+
+Run from the repository root: python -m unittest discover tests
+"""
+import socket
+from threading import Thread
+from time import perf_counter, sleep
+import unittest
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from peers import PeerClient
+
+
+# Seconds the slow stand-in node waits before it answers
+SLOW_DELAY = 1
+# Timeout of the client, far below SLOW_DELAY
+TIMEOUT = (0.5, 0.3)
+
+
+def create_peer_app(name, status_code=200, delay=0):
+    """Returns a stand-in peer node which answers every request with its name
+    and the given status code after waiting `delay` seconds."""
+    app = Flask(name)
+
+    @app.route('/status', methods=['GET'])
+    def status():
+        sleep(delay)
+        return jsonify({'node': name}), status_code
+
+    @app.route('/broadcast-block', methods=['POST'])
+    def broadcast_block():
+        sleep(delay)
+        return jsonify({'node': name, 'received': request.get_json()}), status_code
+
+    @app.route('/text', methods=['GET'])
+    def text():
+        return 'no json', status_code
+
+    return app
+
+
+def unused_node():
+    """Returns the address of a local port nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return '127.0.0.1:{}'.format(sock.getsockname()[1])
+
+
+class PeerClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = []
+        cls.nodes = {}
+        peers = {
+            'ok': create_peer_app('ok'),
+            'conflict': create_peer_app('conflict', status_code=409),
+            'broken': create_peer_app('broken', status_code=500),
+            'slow': create_peer_app('slow', delay=SLOW_DELAY),
+            'also slow': create_peer_app('also slow', delay=SLOW_DELAY)
+        }
+        for (name, app) in peers.items():
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            Thread(target=server.serve_forever, daemon=True).start()
+            cls.servers.append(server)
+            cls.nodes[name] = '127.0.0.1:{}'.format(server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        self.client = PeerClient(timeout=TIMEOUT)
+
+    def test_fan_out_returns_every_response(self):
+        nodes = [self.nodes['ok'], self.nodes['conflict'], self.nodes['broken']]
+        results = self.client.fan_out(nodes, 'GET', '/status')
+        self.assertEqual(set(results), set(nodes))
+        self.assertEqual(results[self.nodes['ok']].status_code, 200)
+        self.assertEqual(results[self.nodes['conflict']].status_code, 409)
+        self.assertEqual(results[self.nodes['broken']].status_code, 500)
+        for (name, node) in self.nodes.items():
+            if node in results:
+                self.assertEqual(results[node].json()['node'], name)
+
+    def test_fan_out_posts_json(self):
+        block = {'index': 1, 'transactions': []}
+        results = self.client.fan_out([self.nodes['ok'], self.nodes['conflict']],
+                                      'POST', '/broadcast-block', json={'block': block})
+        for response in results.values():
+            self.assertEqual(response.json()['received'], {'block': block})
+
+    def test_timeout_and_unreachable_give_none(self):
+        unreachable = unused_node()
+        start = perf_counter()
+        results = self.client.fan_out([self.nodes['slow'], unreachable, self.nodes['ok']],
+                                      'GET', '/status')
+        self.assertLess(perf_counter() - start, SLOW_DELAY)
+        self.assertIsNone(results[self.nodes['slow']])
+        self.assertIsNone(results[unreachable])
+        self.assertEqual(results[self.nodes['ok']].status_code, 200)
+
+    def test_nodes_are_contacted_concurrently(self):
+        client = PeerClient(timeout=(0.5, SLOW_DELAY * 3))
+        nodes = [self.nodes['slow'], self.nodes['also slow']]
+        start = perf_counter()
+        results = client.fan_out(nodes, 'GET', '/status')
+        self.assertLess(perf_counter() - start, SLOW_DELAY * len(nodes))
+        self.assertEqual([results[node].status_code for node in nodes], [200, 200])
+
+    def test_run_all_gives_none_for_bad_answers(self):
+        results = self.client.run_all(
+            [self.nodes['ok'], self.nodes['broken']],
+            lambda node: self.client.get(node, '/text').json())
+        self.assertEqual(results, {self.nodes['ok']: None, self.nodes['broken']: None})
+
+    def test_forget_closes_the_session(self):
+        node = self.nodes['ok']
+        self.assertEqual(self.client.get(node, '/status').status_code, 200)
+        self.client.forget(node)
+        self.client.forget(node)
+        self.assertEqual(self.client.get(node, '/status').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,114 @@
 from collections import OrderedDict
+import json
 
+from key_registry import address_of
+from utility.hash_util import hash_string_256
 from utility.printable import Printable
 
 
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
 class Transaction(Printable):
+    """An immutable transfer of coins from a sender to a recipient.
+
+    The optional fee is paid by the sender to the miner of the block. It is
+    only part of the serialized form if it is not zero, so transactions
+    without a fee keep their ID and signature.
+    """
+
+    __slots__ = ('sender', 'recipient', 'amount', 'signature', 'fee', '_id', '_size')
+
+    def __init__(self, sender, recipient, signature, amount, fee=0):
+        object.__setattr__(self, 'sender', sender)
+        object.__setattr__(self, 'recipient', recipient)
+        object.__setattr__(self, 'amount', amount)
+        object.__setattr__(self, 'signature', signature)
+        object.__setattr__(self, 'fee', fee)
+        canonical_bytes = self.canonical_bytes
+        object.__setattr__(self, '_id', hash_string_256(canonical_bytes))
+        object.__setattr__(self, '_size', len(canonical_bytes))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Transaction is immutable')
+
+    def __reduce__(self):
+        return (Transaction, (self.sender, self.recipient, self.signature, self.amount, self.fee))
+
+    @property
+    def canonical_bytes(self):
+        """The serialized form of the transaction its ID is computed from."""
+        return json.dumps(self.to_dict(), sort_keys=True).encode()
+
+    @property
+    def sender_address(self):
+        """The address of the sender, whether it is given by key or by address."""
+        return address_of(self.sender)
 
-    def __init__(self, sender, recipient, signature, amount):
-        self.sender = sender
-        self.recipient = recipient
-        self.amount = amount
-        self.signature = signature
+    @property
+    def recipient_address(self):
+        """The address of the recipient, whether it is given by key or by address."""
+        return address_of(self.recipient)
+
+    @property
+    def cost(self):
+        """What the sender is charged, the amount and the fee."""
+        return self.amount + self.fee
+
+    @property
+    def size(self):
+        """The length of the serialized form in bytes, counted against the block size."""
+        return self._size
+
+    @property
+    def id(self):
+        """The hash of the fields and the signature of the transaction."""
+        return self._id
 
     def to_ordered_dict(self):
-        return OrderedDict([
+        ordered_dict = OrderedDict([
             ('sender', self.sender),
             ('recipient', self.recipient),
             ('signature', self.signature),
             ('amount', self.amount)
         ])
+        if self.fee:
+            ordered_dict['fee'] = self.fee
+        return ordered_dict
+
+    def to_dict(self):
+        transaction = {
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'signature': self.signature,
+            'amount': self.amount
+        }
+        if self.fee:
+            transaction['fee'] = self.fee
+        return transaction
+
+    @staticmethod
+    def from_dict(transaction):
+        """Returns new instance of Transaction class converted from a dictionary.
+
+        Raises ValueError if a field has the wrong type (see decoded).
+        """
+        return Transaction.decoded(transaction['sender'],
+                                   transaction['recipient'],
+                                   transaction['signature'],
+                                   transaction['amount'],
+                                   transaction.get('fee', 0))
+
+    @staticmethod
+    def decoded(sender, recipient, signature, amount, fee=0):
+        """Returns a new Transaction of fields decoded from data of peer nodes.
+
+        Raises ValueError if sender, recipient or signature is no string, or
+        amount or fee is no number.
+        """
+        if not all(isinstance(value, str) for value in (sender, recipient, signature)):
+            raise ValueError('Transaction sender, recipient and signature must be strings')
+        if not (is_number(amount) and is_number(fee)):
+            raise ValueError('Transaction amount and fee must be numbers')
+        return Transaction(sender, recipient, signature, amount, fee)
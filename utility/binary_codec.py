@@ -0,0 +1,198 @@
+"""Compact binary encoding of blocks and transactions.
+
+Hex encoded fields (keys, signatures, hashes) are stored as raw bytes,
+every variable sized field is prefixed with its length. All integers are
+big-endian.
+
+    transaction = field sender, field recipient, field signature, number amount,
+                  [number fee] (only if the transaction has one)
+    block       = number index, field previous_hash, number timestamp,
+                  number proof, number difficulty, uint32 count, count * (uint32 size, transaction),
+                  [field merkle_root] (only if the block has one)
+    blocks      = uint32 count, count * (uint32 size, block)
+    field       = uint8 kind (0 hex, 1 text), uint32 size, size * byte
+    number      = uint8 kind (0 int64, 1 float64, 2 JSON text) and its value
+"""
+import binascii
+import json
+import struct
+
+from block import Block
+from transaction import Transaction
+
+
+CONTENT_TYPE = 'application/x-blockchain-binary'
+
+FIELD_HEX = 0
+FIELD_TEXT = 1
+NUMBER_INT = 0
+NUMBER_FLOAT = 1
+NUMBER_JSON = 2
+
+UINT8 = struct.Struct('>B')
+UINT32 = struct.Struct('>I')
+INT64 = struct.Struct('>q')
+FLOAT64 = struct.Struct('>d')
+
+
+def encode_transaction(transaction):
+    parts = [
+        _encode_field(transaction.sender),
+        _encode_field(transaction.recipient),
+        _encode_field(transaction.signature),
+        _encode_number(transaction.amount)
+    ]
+    if transaction.fee:
+        parts.append(_encode_number(transaction.fee))
+    return b''.join(parts)
+
+
+def decode_transaction(data):
+    """Returns the Transaction encoded in data.
+
+    Raises ValueError if data is no valid encoding.
+    """
+    try:
+        (transaction, _) = _decode_transaction(memoryview(data), 0)
+    except (struct.error, UnicodeDecodeError) as error:
+        raise ValueError('Malformed transaction: {}'.format(error))
+    return transaction
+
+
+def encode_block(block):
+    parts = [
+        _encode_number(block.index),
+        _encode_field(block.previous_hash),
+        _encode_number(block.timestamp),
+        _encode_number(block.proof),
+        _encode_number(block.difficulty),
+        UINT32.pack(len(block.transactions))
+    ]
+    for tx in block.transactions:
+        parts.append(_sized(encode_transaction(tx)))
+    if block.merkle_root is not None:
+        parts.append(_encode_field(block.merkle_root))
+    return b''.join(parts)
+
+
+def decode_block(data):
+    """Returns the Block encoded in data.
+
+    Raises ValueError if data is no valid encoding.
+    """
+    try:
+        (block, _) = _decode_block(memoryview(data), 0)
+    except (struct.error, UnicodeDecodeError) as error:
+        raise ValueError('Malformed block: {}'.format(error))
+    return block
+
+
+def encode_blocks(blocks):
+    return UINT32.pack(len(blocks)) + b''.join(_sized(encode_block(block)) for block in blocks)
+
+
+def encode_block_list(encoded_blocks):
+    """Joins already encoded blocks into the encoding of a block list."""
+    return UINT32.pack(len(encoded_blocks)) + b''.join(_sized(data) for data in encoded_blocks)
+
+
+def decode_blocks(data):
+    """Returns the list of Blocks encoded in data.
+
+    Raises ValueError if data is no valid encoding.
+    """
+    data = memoryview(data)
+    blocks = []
+    try:
+        (count,) = UINT32.unpack_from(data, 0)
+        offset = UINT32.size
+        for _ in range(count):
+            (size,) = UINT32.unpack_from(data, offset)
+            offset += UINT32.size
+            (block, _) = _decode_block(data[offset:offset + size], 0)
+            blocks.append(block)
+            offset += size
+    except (struct.error, UnicodeDecodeError) as error:
+        raise ValueError('Malformed block list: {}'.format(error))
+    return blocks
+
+
+def _decode_transaction(data, offset):
+    (sender, offset) = _decode_field(data, offset)
+    (recipient, offset) = _decode_field(data, offset)
+    (signature, offset) = _decode_field(data, offset)
+    (amount, offset) = _decode_number(data, offset)
+    fee = 0
+    if offset < len(data):
+        (fee, offset) = _decode_number(data, offset)
+    return Transaction.decoded(sender, recipient, signature, amount, fee), offset
+
+
+def _decode_block(data, offset):
+    (index, offset) = _decode_number(data, offset)
+    (previous_hash, offset) = _decode_field(data, offset)
+    (timestamp, offset) = _decode_number(data, offset)
+    (proof, offset) = _decode_number(data, offset)
+    (difficulty, offset) = _decode_number(data, offset)
+    (count,) = UINT32.unpack_from(data, offset)
+    offset += UINT32.size
+    transactions = []
+    for _ in range(count):
+        (size,) = UINT32.unpack_from(data, offset)
+        offset += UINT32.size
+        (tx, _) = _decode_transaction(data[offset:offset + size], 0)
+        transactions.append(tx)
+        offset += size
+    merkle_root = None
+    if offset < len(data):
+        (merkle_root, offset) = _decode_field(data, offset)
+    block = Block.decoded(index, previous_hash, transactions, proof, timestamp, difficulty,
+                          merkle_root)
+    return block, offset
+
+
+def _sized(data):
+    return UINT32.pack(len(data)) + data
+
+
+def _encode_field(value):
+    """Encodes a string, as raw bytes if it is lower case hex which survives the round trip."""
+    if len(value) % 2 == 0 and value == value.lower():
+        try:
+            raw = binascii.unhexlify(value)
+            return UINT8.pack(FIELD_HEX) + _sized(raw)
+        except (binascii.Error, ValueError):
+            pass
+    return UINT8.pack(FIELD_TEXT) + _sized(value.encode('utf8'))
+
+
+def _decode_field(data, offset):
+    (kind,) = UINT8.unpack_from(data, offset)
+    (size,) = UINT32.unpack_from(data, offset + UINT8.size)
+    start = offset + UINT8.size + UINT32.size
+    raw = bytes(data[start:start + size])
+    if kind == FIELD_HEX:
+        value = binascii.hexlify(raw).decode('ascii')
+    else:
+        value = raw.decode('utf8')
+    return value, start + size
+
+
+def _encode_number(value):
+    if isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63:
+        return UINT8.pack(NUMBER_INT) + INT64.pack(value)
+    if isinstance(value, float):
+        return UINT8.pack(NUMBER_FLOAT) + FLOAT64.pack(value)
+    return UINT8.pack(NUMBER_JSON) + _sized(json.dumps(value).encode('utf8'))
+
+
+def _decode_number(data, offset):
+    (kind,) = UINT8.unpack_from(data, offset)
+    offset += UINT8.size
+    if kind == NUMBER_INT:
+        return INT64.unpack_from(data, offset)[0], offset + INT64.size
+    if kind == NUMBER_FLOAT:
+        return FLOAT64.unpack_from(data, offset)[0], offset + FLOAT64.size
+    (size,) = UINT32.unpack_from(data, offset)
+    start = offset + UINT32.size
+    return json.loads(bytes(data[start:start + size]).decode('utf8')), start + size
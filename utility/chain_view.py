@@ -0,0 +1,60 @@
+from collections.abc import Sequence
+
+
+class ChainView(Sequence):
+    """Read-only view of the first `length` blocks of a chain.
+
+    The blockchain only ever appends to its chain or replaces it with a new
+    one, so the blocks a view covers never change and handing out a view
+    needs no copy.
+    """
+
+    def __init__(self, blocks, length):
+        self.__blocks = blocks
+        self.__length = length
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.__blocks[i] for i in range(self.__length)[index]]
+        if index < 0:
+            index += self.__length
+        if not 0 <= index < self.__length:
+            raise IndexError('block index out of range')
+        return self.__blocks[index]
+
+    def __iter__(self):
+        for index in range(self.__length):
+            yield self.__blocks[index]
+
+
+class ForkView(Sequence):
+    """Read-only view of the blocks of a chain up to a fork followed by the blocks
+    of another chain, without copying the shared blocks."""
+
+    def __init__(self, chain, fork_index, suffix):
+        """
+        Arguments:
+            :chain: The local chain (or a view of it).
+            :fork_index: The index of the last block both chains share.
+            :suffix: The blocks of the other chain after the fork.
+        """
+        self.__chain = chain
+        self.__fork_length = fork_index + 1
+        self.suffix = suffix
+
+    def __len__(self):
+        return self.__fork_length + len(self.suffix)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('block index out of range')
+        if index < self.__fork_length:
+            return self.__chain[index]
+        return self.suffix[index - self.__fork_length]
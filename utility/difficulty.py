@@ -0,0 +1,90 @@
+from math import log2
+
+
+# Leading zero bits a block hash needs when no retargeting happened yet
+# (8 bits are the former '00' hex prefix)
+DEFAULT_DIFFICULTY = 8
+# The number of seconds we want between two blocks
+TARGET_BLOCK_TIME = 10
+# After how many blocks the difficulty is adjusted
+RETARGET_INTERVAL = 10
+# By how many bits the difficulty may change in a single retarget
+MAX_ADJUSTMENT = 2
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 64
+# A block timestamp has to be later than the median timestamp of this many
+# previous blocks
+MEDIAN_TIME_BLOCKS = 11
+# How many seconds a block timestamp may be ahead of the local clock
+MAX_FUTURE_DRIFT = 120
+
+
+def target(difficulty):
+    """Returns the number a proof hash has to stay below for a difficulty."""
+    return 1 << (256 - difficulty)
+
+
+def block_work(difficulty):
+    """Returns the number of hashes a proof of a difficulty takes on average,
+    the weight of a block when chains are compared."""
+    return 1 << difficulty
+
+
+def chain_work(blocks):
+    """Returns the summed work of blocks (see block_work)."""
+    return sum(block_work(block.difficulty) for block in blocks)
+
+
+def median_time_past(chain, index):
+    """Returns the median timestamp of the MEDIAN_TIME_BLOCKS blocks before `index`."""
+    timestamps = sorted(
+        chain[i].timestamp
+        for i in range(max(0, index - MEDIAN_TIME_BLOCKS), index)
+    )
+    return timestamps[len(timestamps) // 2]
+
+
+def valid_timestamp(chain, index, timestamp, now):
+    """Returns True if a block at `index` may claim a timestamp: later than the
+    median of the previous blocks and at most MAX_FUTURE_DRIFT seconds ahead
+    of now. Bounds the timestamps the difficulty is retargeted from, so a
+    miner can't lower the difficulty by claiming blocks took longer.
+
+    Arguments:
+        :chain: The chain holding (at least) the blocks before `index`.
+        :index: The index of the block.
+        :timestamp: The timestamp the block claims.
+        :now: The current time of the local clock.
+    """
+    return median_time_past(chain, index) < timestamp <= now + MAX_FUTURE_DRIFT
+
+
+def next_difficulty(chain, index):
+    """Returns the difficulty the block at `index` has to claim.
+
+    Every RETARGET_INTERVAL blocks the time the last RETARGET_INTERVAL blocks
+    took is compared to TARGET_BLOCK_TIME, otherwise the difficulty of the
+    previous block is kept. The genesis block never takes part because of its
+    fixed timestamp, and neither do blocks without a Merkle root: older
+    versions gave all blocks mined by one process the same timestamp.
+
+    Arguments:
+        :chain: The chain holding (at least) the blocks before `index`.
+        :index: The index of the block the difficulty is for.
+    """
+    if index <= RETARGET_INTERVAL:
+        return DEFAULT_DIFFICULTY
+    last_difficulty = chain[index - 1].difficulty
+    if index % RETARGET_INTERVAL != 0:
+        return last_difficulty
+    if chain[index - RETARGET_INTERVAL].merkle_root is None:
+        return last_difficulty
+
+    actual_time = chain[index - 1].timestamp - chain[index - RETARGET_INTERVAL].timestamp
+    expected_time = (RETARGET_INTERVAL - 1) * TARGET_BLOCK_TIME
+    if actual_time <= 0:
+        adjustment = MAX_ADJUSTMENT
+    else:
+        adjustment = round(log2(expected_time / actual_time))
+        adjustment = max(-MAX_ADJUSTMENT, min(MAX_ADJUSTMENT, adjustment))
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, last_difficulty + adjustment))
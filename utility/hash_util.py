@@ -1,5 +1,4 @@
 import hashlib as hl
-import json
 
 
 def hash_string_256(string):
@@ -7,16 +6,9 @@ def hash_string_256(string):
 
 
 def hash_block(block):
-    """Hashes a block and returns a string representation of it.
+    """Returns the hash of a block which the block computed once when it was built.
 
     Arguments:
         :block: The block that should be hashed.
     """
-    hashable_block = block.__dict__.copy()
-    hashable_block['transactions'] = [
-        tx.to_ordered_dict()
-        for tx in hashable_block['transactions']
-    ]
-    return hash_string_256(
-        json.dumps(hashable_block, sort_keys=True).encode()
-    )
+    return block.hash
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """A bounded, thread-safe mapping which evicts the least recently used entry."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key, load):
+        """Returns the cached value for a key, or loads, caches and returns it.
+
+        Arguments:
+            :key: The key the value is cached under.
+            :load: Function without arguments which creates the value on a miss.
+        """
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__entries[key]
+            self.misses += 1
+
+        value = load()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        """Returns the size and the hit/miss counters of the cache."""
+        return {
+            'size': len(self.__entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
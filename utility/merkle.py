@@ -0,0 +1,67 @@
+import hashlib as hl
+
+
+# Root of a block without transactions
+EMPTY_ROOT = '0' * 64
+
+
+def merkle_root(tx_ids):
+    """Returns the hex Merkle root over a list of hex transaction IDs.
+
+    Pairs of hashes are hashed together level by level; an odd hash at the end
+    of a level is carried up unchanged.
+
+    Arguments:
+        :tx_ids: The IDs of the transactions in block order.
+    """
+    if not tx_ids:
+        return EMPTY_ROOT
+    level = [bytes.fromhex(tx_id) for tx_id in tx_ids]
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(tx_ids, position):
+    """Returns the path proving that the transaction at `position` is part of
+    the Merkle root of tx_ids, as a list of {'hash', 'side'} dictionaries from
+    the leaf up. 'side' tells on which side the hash is joined.
+
+    Arguments:
+        :tx_ids: The IDs of the transactions in block order.
+        :position: The position of the transaction in the block.
+    """
+    level = [bytes.fromhex(tx_id) for tx_id in tx_ids]
+    path = []
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            path.append({
+                'hash': level[sibling].hex(),
+                'side': 'left' if sibling < position else 'right'
+            })
+        level = _next_level(level)
+        position //= 2
+    return path
+
+
+def verify_merkle_proof(tx_id, path, root):
+    """Returns True if a path from merkle_proof leads from tx_id to root."""
+    current = bytes.fromhex(tx_id)
+    for step in path:
+        sibling = bytes.fromhex(step['hash'])
+        if step['side'] == 'left':
+            current = hl.sha256(sibling + current).digest()
+        else:
+            current = hl.sha256(current + sibling).digest()
+    return current.hex() == root
+
+
+def _next_level(level):
+    next_level = [
+        hl.sha256(level[i] + level[i + 1]).digest()
+        for i in range(0, len(level) - 1, 2)
+    ]
+    if len(level) % 2 == 1:
+        next_level.append(level[-1])
+    return next_level
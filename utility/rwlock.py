@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from threading import Condition, get_ident
+
+
+class RWLock:
+    """A lock which lets many readers or a single writer in at a time.
+
+    Waiting writers are preferred over new readers, so a steady stream of
+    readers can't starve them. The writing thread may take the write lock
+    again and may also read while it holds it.
+    """
+
+    def __init__(self):
+        self.__condition = Condition()
+        self.__readers = 0
+        self.__writer = None
+        self.__writer_depth = 0
+        self.__waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        owns_write = self.__writer == get_ident()
+        if not owns_write:
+            with self.__condition:
+                while self.__writer is not None or self.__waiting_writers > 0:
+                    self.__condition.wait()
+                self.__readers += 1
+        try:
+            yield
+        finally:
+            if not owns_write:
+                with self.__condition:
+                    self.__readers -= 1
+                    if self.__readers == 0:
+                        self.__condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = get_ident()
+        with self.__condition:
+            if self.__writer != me:
+                self.__waiting_writers += 1
+                while self.__writer is not None or self.__readers > 0:
+                    self.__condition.wait()
+                self.__waiting_writers -= 1
+                self.__writer = me
+            self.__writer_depth += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__writer_depth -= 1
+                if self.__writer_depth == 0:
+                    self.__writer = None
+                    self.__condition.notify_all()
@@ -1,57 +1,204 @@
-from utility.hash_util import hash_string_256, hash_block
+import hashlib as hl
+from time import time
 
-from wallet import Wallet
+from block import PROOF
+from utility.difficulty import DEFAULT_DIFFICULTY, next_difficulty, target, valid_timestamp
+from utility.hash_util import hash_block
+from utility.merkle import merkle_root
+
+from key_registry import KeyRegistry
+from wallet import Wallet, key_registry
 
 
 class Verification:
 
     @staticmethod
-    def valid_proof(transactions, last_hash, proof):
-        """Validate a proof of work number and see if it solves the puzzle algorithm (two leading 0s)
+    def valid_proof(transactions, last_hash, proof, difficulty=DEFAULT_DIFFICULTY):
+        """Validate a proof of work number and see if it solves the puzzle algorithm
+        (hash below the target of the difficulty)
 
         Arguments:
             :transactions: The transactions of the block for which the proof is created.
             :last_hash: The previous block's hash which will be stored in the current block.
             :proof: The proof number we're testing.
+            :difficulty: The number of leading zero bits the hash needs.
         """
+        return PreparedProof(transactions, last_hash, difficulty).is_valid(proof)
+
+    @staticmethod
+    def proof_prefix(transactions, last_hash):
+        """Returns the part of the proof of work input which does not depend on the proof."""
         ordered_transactions = [
             tx.to_ordered_dict()
             for tx in transactions
         ]
-        guess = (str(ordered_transactions) +
-                 str(last_hash) + str(proof)).encode()
-        guess_hash = hash_string_256(guess)
-        # print(f'guess_hash: {guess_hash}')
+        return (str(ordered_transactions) + str(last_hash)).encode()
+
+    @staticmethod
+    def valid_block_proof(block):
+        """Checks the proof of work of a block, and its Merkle root if it has one.
+
+        The proof of a block with a Merkle root is valid if the block hash, the
+        hash of its header, is below the target. Older blocks prove the work on
+        their transactions without the mining reward and the previous hash.
+
+        Arguments:
+            :block: The block which should be checked.
+        """
+        if block.merkle_root is None:
+            prepared_proof = PreparedProof(block.transactions[:-1],
+                                           block.previous_hash,
+                                           block.difficulty)
+            return prepared_proof.is_valid(block.proof)
+        if block.merkle_root != merkle_root([tx.id for tx in block.transactions]):
+            return False
+        return int(block.hash, 16) < target(block.difficulty)
+
+    @staticmethod
+    def valid_difficulty(chain, block):
+        """Checks the difficulty a block claims against the retargeting rules.
+
+        Arguments:
+            :chain: The chain holding (at least) the blocks before the block.
+            :block: The block which should be checked.
+        """
+        return block.difficulty == next_difficulty(chain, block.index)
+
+    @staticmethod
+    def valid_block_time(chain, block):
+        """Checks the timestamp of a block against the previous blocks and the
+        local clock (see utility.difficulty.valid_timestamp).
+
+        Arguments:
+            :chain: The chain holding (at least) the blocks before the block.
+            :block: The block which should be checked.
+        """
+        return valid_timestamp(chain, block.index, block.timestamp, time())
+
+    @staticmethod
+    def valid_reward(block, mining_reward):
+        """Checks that only the last transaction of a block pays a mining reward
+        and that it pays at most mining_reward plus the fees of the block.
 
-        return guess_hash[0:2] == '00'
+        The reward must hold the block index in its signature field, so no two
+        rewards share an ID.
+
+        Arguments:
+            :block: The block which should be checked.
+            :mining_reward: The reward for mining a block, without fees.
+        """
+        if not block.transactions:
+            return True
+        transactions = block.transactions[:-1]
+        reward = block.transactions[-1]
+        if any(tx.sender == 'MINING' or tx.fee < 0 for tx in transactions):
+            return False
+        fees = sum(tx.fee for tx in transactions)
+        if reward.signature != str(block.index):
+            return False
+        return reward.sender == 'MINING' and reward.amount <= mining_reward + fees
 
     @classmethod
-    def verify_chain(cls, blockchain):
-        """ Verify the current blockchein and return True if it's valid. """
+    def verify_chain(cls, blockchain, start=1, mining_reward=None):
+        """ Verify the current blockchein and return True if it's valid.
+
+        The verified blocks come from peer nodes and need a Merkle root; blocks
+        without one are only accepted among the trusted blocks before `start`.
+        A sender named by address needs a key from an earlier block of the same
+        chain: the trusted blocks, which are the local chain's, or the verified
+        ones before its block. key_registry is not changed.
+
+        Arguments:
+            :blockchain: The chain which should be verified.
+            :start: The index of the first block to verify, the blocks before are trusted.
+            :mining_reward: If given, the mining reward of every block is checked
+                against it (see valid_reward).
+        """
         # print('  verify_chain()')
-        for (index, block) in enumerate(blockchain):
-            if index == 0:
-                continue
-            if block.previous_hash != hash_block(blockchain[index - 1]):
+        previous_hash = hash_block(blockchain[start - 1])
+        transactions = []
+        public_keys = []
+        verified_keys = KeyRegistry()
+        for index in range(start, len(blockchain)):
+            block = blockchain[index]
+            if block.index != index or block.previous_hash != previous_hash:
+                return False
+            previous_hash = hash_block(block)
+            if block.merkle_root is None:
+                print(f'Block has no Merkle root! - {block.index}')
+                return False
+            if not Verification.valid_difficulty(blockchain, block):
+                print(f'Difficulty is invalid! - {block.difficulty}')
+                return False
+            if not Verification.valid_block_time(blockchain, block):
+                print(f'Timestamp is invalid! - {block.timestamp}')
                 return False
-            if not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof):
+            if not Verification.valid_block_proof(block):
                 print(f'Proof of work is invalid! - {block.proof}')
                 return False
+            if mining_reward is not None and not Verification.valid_reward(block, mining_reward):
+                print(f'Mining reward is invalid! - {block.index}')
+                return False
+            public_keys.extend(
+                verified_keys.resolve(tx.sender) or key_registry.resolve(tx.sender, start)
+                for tx in block.transactions
+            )
+            verified_keys.register_transactions(block.transactions, block.index)
+            transactions.extend(block.transactions)
+        if not all(Wallet.verify_transactions(transactions, public_keys)):
+            print('Signature of a transaction is invalid!')
+            return False
         return True
 
     @staticmethod
     def verify_transaction(transaction, get_balance, check_funds=True):
-        """ Checks whether the sender has enough coins. """
+        """ Checks whether the sender has enough coins for the amount and the fee. """
+        if transaction.fee < 0:
+            return False
         if check_funds:
             sender_balance = get_balance(transaction.sender)
-            return sender_balance >= transaction.amount and Wallet.verify_transaction(transaction)
+            return sender_balance >= transaction.cost and Wallet.verify_transaction(transaction)
         else:
             return Wallet.verify_transaction(transaction)
 
     @classmethod
     def verify_transactions(cls, open_transactions, get_balance):
         """ Verifies all open transactions. """
-        return all([
-            cls.verify_transaction(tx, get_balance, False)
-            for tx in open_transactions
-        ])
+        return all(Wallet.verify_transactions(open_transactions))
+
+
+class PreparedProof:
+    """Proof of work puzzle of one block, prepared for testing many proofs.
+
+    The fixed part of the input (a block header without proof, or formerly the
+    transactions and the previous hash) is hashed once, each tested proof only
+    copies that hash state and adds its own bytes.
+    """
+
+    def __init__(self, transactions=None, last_hash=None, difficulty=DEFAULT_DIFFICULTY,
+                 prefix=None, header=False):
+        """
+        Arguments:
+            :transactions: The transactions of a block without Merkle root.
+            :last_hash: The previous hash of a block without Merkle root.
+            :difficulty: The number of leading zero bits the hash needs.
+            :prefix: The already serialized fixed part of the input.
+            :header: True if prefix is a block header, which takes the proof
+                as a 64 bit number instead of its digits.
+        """
+        if prefix is None:
+            prefix = Verification.proof_prefix(transactions, last_hash)
+        self.prefix = prefix
+        self.header = header
+        self.difficulty = difficulty
+        self.__target = target(difficulty)
+        self.__state = hl.sha256(prefix)
+
+    def is_valid(self, proof):
+        """Validate a proof number and see if it solves the puzzle algorithm
+        (hash below the target of the difficulty)"""
+        guess = self.__state.copy()
+        guess.update(PROOF.pack(proof) if self.header else str(proof).encode())
+        # print(f'guess_hash: {guess.hexdigest()}')
+
+        return int.from_bytes(guess.digest(), 'big') < self.__target
@@ -1,9 +1,50 @@
 import binascii
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from threading import Lock
+
 from Crypto.Signature import pkcs1_15
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
 
+from key_registry import KeyRegistry, address_of
 from transaction import Transaction
+from utility.lru_cache import LRUCache
+
+
+# Batches with fewer transactions are verified in the calling process
+PARALLEL_VERIFY_THRESHOLD = 32
+# How many processes verify signatures (None uses all cores)
+VERIFY_WORKERS = None
+# How the verify processes are started. Not 'fork': the node is multi-threaded
+# and a forked worker could inherit a lock (like the key cache's) held by
+# another thread, and hang on it forever.
+VERIFY_START_METHOD = 'spawn'
+
+# How many parsed RSA keys are kept in memory
+KEY_CACHE_SIZE = 4096
+# How many IDs of transactions with a verified signature are remembered
+VERIFIED_CACHE_SIZE = 100000
+
+verify_pool = None
+verify_pool_lock = Lock()
+key_cache = LRUCache(KEY_CACHE_SIZE)
+verified_cache = LRUCache(VERIFIED_CACHE_SIZE)
+# The public keys seen in the blocks of the chain, by address, so senders can
+# be named by address
+key_registry = KeyRegistry()
+
+
+def get_verify_pool():
+    """Returns the process pool for signature verification, created on first use."""
+    global verify_pool
+    with verify_pool_lock:
+        if verify_pool is None:
+            verify_pool = ProcessPoolExecutor(
+                max_workers=VERIFY_WORKERS,
+                mp_context=multiprocessing.get_context(VERIFY_START_METHOD))
+        return verify_pool
 
 
 class Wallet:
@@ -12,6 +53,13 @@ class Wallet:
         self.public_key = None
         self.node_id = node_id
 
+    @property
+    def address(self):
+        """The short address of the public key, or None without keys."""
+        if self.public_key is None:
+            return None
+        return address_of(self.public_key)
+
     def create_keys(self):
         private_key, public_key = self.generate_keys()
         self.private_key = private_key
@@ -47,9 +95,9 @@ class Wallet:
 
         return (Wallet.__key_to_string(private_key), Wallet.__key_to_string(public_key))
 
-    def sign_transaction(self, sender, recipient, amount):
+    def sign_transaction(self, sender, recipient, amount, fee=0):
         signer = pkcs1_15.new(Wallet.__string_to_key(self.private_key))
-        h = Wallet.__to_hash(sender, recipient, amount)
+        h = Wallet.__to_hash(sender, recipient, amount, fee)
         signature = signer.sign(h)
 
         return binascii.hexlify(signature).decode('ascii')
@@ -59,25 +107,105 @@ class Wallet:
         if transaction.sender == 'MINING':
             return True
 
-        public_key = Wallet.__string_to_key(transaction.sender)
-        verifier = pkcs1_15.new(public_key)
+        public_key = key_registry.resolve(transaction.sender)
+        if public_key is None:
+            return False
+        if transaction.id in verified_cache:
+            return True
+        is_valid = Wallet.verify_signature(transaction, public_key)
+        if is_valid:
+            verified_cache.put(transaction.id, True)
+        return is_valid
+
+    @staticmethod
+    def verify_transactions(transactions, public_keys=None):
+        """Verifies the signatures of many transactions, spread across a process pool.
+        Transactions which were verified before are not checked again, those
+        naming their sender by an unknown address are invalid.
+
+        Returns a list with one result per transaction, in the given order.
+
+        Arguments:
+            :transactions: The transactions which should be verified.
+            :public_keys: The key of the sender of each transaction, None if it
+                is unknown. Resolved through key_registry if not given.
+        """
+        if public_keys is None:
+            public_keys = [key_registry.resolve(tx.sender) for tx in transactions]
+        results = [
+            tx.sender == 'MINING' or (public_key is not None and tx.id in verified_cache)
+            for (tx, public_key) in zip(transactions, public_keys)
+        ]
+        unverified = [
+            index
+            for (index, is_valid) in enumerate(results)
+            if not is_valid
+        ]
+        unverified_transactions = [transactions[index] for index in unverified]
+        unverified_keys = [public_keys[index] for index in unverified]
+
+        if len(unverified) < PARALLEL_VERIFY_THRESHOLD:
+            checked = [
+                Wallet.verify_signature(tx, public_key)
+                for (tx, public_key) in zip(unverified_transactions, unverified_keys)
+            ]
+        else:
+            workers = VERIFY_WORKERS or os.cpu_count() or 1
+            chunksize = max(1, len(unverified) // (workers * 4))
+            checked = get_verify_pool().map(Wallet.verify_signature,
+                                            unverified_transactions,
+                                            unverified_keys,
+                                            chunksize=chunksize)
+
+        for (index, is_valid) in zip(unverified, checked):
+            results[index] = is_valid
+            if is_valid:
+                verified_cache.put(transactions[index].id, True)
+        return results
+
+    @staticmethod
+    def forget_verified_transactions():
+        """Drops all remembered verification results."""
+        verified_cache.clear()
+
+    @staticmethod
+    def verify_signature(transaction, public_key):
+        """Checks the signature of a transaction without consulting the cache.
+
+        Arguments:
+            :transaction: The transaction which should be verified.
+            :public_key: The hex encoded key of the sender, None if it is unknown.
+        """
+        if public_key is None:
+            return False
         h = Wallet.__to_hash(transaction.sender,
                              transaction.recipient,
-                             transaction.amount)
+                             transaction.amount,
+                             transaction.fee)
 
+        # A sender which is no valid key fails to parse (binascii.Error is a
+        # ValueError), which makes the signature invalid like a wrong one
         try:
+            verifier = pkcs1_15.new(Wallet.__string_to_key(public_key))
             verifier.verify(h, binascii.unhexlify(transaction.signature))
             return True
-        except (ValueError, TypeError):
+        except (ValueError, TypeError, IndexError):
             return False
 
     @staticmethod
-    def __to_hash(sender, recipient, amount):
-        return SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf8'))
+    def __to_hash(sender, recipient, amount, fee=0):
+        """Hashes the signed fields. A fee is only appended, after a separator no
+        amount contains, if it is not zero, so signatures of transactions
+        without a fee stay valid."""
+        message = str(sender) + str(recipient) + str(amount)
+        if fee:
+            message += ':' + str(fee)
+        return SHA256.new(message.encode('utf8'))
 
     @staticmethod
     def __string_to_key(str):
-        return RSA.import_key(binascii.unhexlify(str))
+        """Returns the parsed key of a hex string, cached by that string."""
+        return key_cache.get(str, lambda: RSA.import_key(binascii.unhexlify(str)))
 
     @staticmethod
     def __key_to_string(key):